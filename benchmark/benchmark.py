@@ -0,0 +1,278 @@
+"""
+Benchmarks chart request creation and derivation, generation, config file rendering, options build and
+output serialization.
+
+Usage::
+
+    python benchmark/benchmark.py
+    python benchmark/benchmark.py --releases 1 100 --variant tls metrics
+    python benchmark/benchmark.py --releases 100 --variant all --profile generate
+"""
+import argparse
+import cProfile
+import gc
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, TextIO
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from kubragen2.configfile import ConfigFileRender_SysCtl, ConfigFileRender_RawStr  # noqa: E402
+from kubragen2.kdatahelper import KDataHelper_ConfigFile  # noqa: E402
+from kubragen2.output import OutputFile_Kubernetes, OutputDataDumper  # noqa: E402
+
+import hmi_rabbitmq.chart  # noqa: E402
+from hmi_rabbitmq import RabbitMQChartRequest, RabbitMQConfigFile, write_yaml, write_json, write_ndjson  # noqa: E402
+from hmi_rabbitmq.output import YAML_DUMPER  # noqa: E402
+
+
+VARIANTS: Mapping[str, Callable[[], Dict[str, Any]]] = {
+    'default': lambda: {},
+    'tls': lambda: {
+        'auth': {
+            'tls': {
+                'enabled': True,
+            },
+        },
+    },
+    'metrics': lambda: {
+        'metrics': {
+            'enabled': True,
+            'serviceMonitor': {
+                'enabled': True,
+            },
+        },
+    },
+    'loaddefinition': lambda: {
+        'loadDefinition': {
+            'enabled': True,
+            'value': '{"queues": []}',
+        },
+    },
+    'all': lambda: {
+        'configuration': RabbitMQConfigFile(merge_config={'log.console.level': 'warning'}),
+        'auth': {
+            'tls': {
+                'enabled': True,
+            },
+        },
+        'metrics': {
+            'enabled': True,
+            'serviceMonitor': {
+                'enabled': True,
+            },
+        },
+        'loadDefinition': {
+            'enabled': True,
+            'value': '{"queues": []}',
+        },
+        'memoryHighWatermark': {
+            'enabled': True,
+        },
+        'resources': {
+            'limits': {
+                'cpu': '2',
+                'memory': '2Gi',
+            },
+        },
+        'extraConfiguration': 'log.file.level = info\nhandshake_timeout = 20000',
+    },
+}
+
+
+class _TimedBuildData:
+    """
+    Wraps OptionsBuildData in the chart module to time it during generate().
+    """
+    def __init__(self, func: Callable[..., Any]):
+        self.func = func
+        self.elapsed = 0.0
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        start = time.perf_counter()
+        try:
+            return self.func(*args, **kwargs)
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+
+def make_requests(variant: str, releases: int) -> List[RabbitMQChartRequest]:
+    return [RabbitMQChartRequest(namespace='tenant-{}'.format(i), releasename='rabbitmq',
+                                 values=VARIANTS[variant]()) for i in range(releases)]
+
+
+def stage_init(variant: str, releases: int) -> Callable[[], Any]:
+    values = [VARIANTS[variant]() for _ in range(releases)]
+    return lambda: [RabbitMQChartRequest(namespace='tenant-{}'.format(i), releasename='rabbitmq',
+                                         values=v) for i, v in enumerate(values)]
+
+
+def stage_derive(variant: str, releases: int) -> Callable[[], Any]:
+    base = RabbitMQChartRequest(namespace='tenant', releasename='rabbitmq', values=VARIANTS[variant]())
+    return lambda: [base.derive(namespace='tenant-{}'.format(i)) for i in range(releases)]
+
+
+def stage_generate(variant: str, releases: int) -> Callable[[], Any]:
+    requests = make_requests(variant, releases)
+    return lambda: [r.generate() for r in requests]
+
+
+def stage_configfile(variant: str, releases: int) -> Callable[[], Any]:
+    requests = make_requests(variant, releases)
+
+    def run() -> Any:
+        return [KDataHelper_ConfigFile.info(r.options().option_get_opt('configuration', RabbitMQConfigFile()),
+                                            r.options(), [ConfigFileRender_SysCtl(), ConfigFileRender_RawStr()])
+                for r in requests]
+    return run
+
+
+def stage_configfile_cached(variant: str, releases: int) -> Callable[[], Any]:
+    requests = make_requests(variant, releases)
+    RabbitMQConfigFile.render_cache.clear()
+
+    def run() -> Any:
+        return [r.options().option_get_opt('configuration', RabbitMQConfigFile()).render(
+            r.options(), [ConfigFileRender_SysCtl(), ConfigFileRender_RawStr()]) for r in requests]
+    return run
+
+
+def _stage_write(write: Callable[[List[Any], TextIO], Any]) -> Callable[[str, int], Callable[[], Any]]:
+    def stage(variant: str, releases: int) -> Callable[[], Any]:
+        data = [d for r in make_requests(variant, releases) for d in r.generate().data]
+
+        def run() -> Any:
+            with open(os.devnull, 'w', encoding='utf-8') as fl:
+                return write(data, fl)
+        return run
+    return stage
+
+
+def _write_kubragen(data: List[Any], stream: TextIO) -> Any:
+    file = OutputFile_Kubernetes('rabbitmq.yaml')
+    file.append(data)
+    return stream.write(file.to_string(OutputDataDumper()))
+
+
+STAGES: Mapping[str, Callable[[str, int], Callable[[], Any]]] = {
+    'init': stage_init,
+    'derive': stage_derive,
+    'generate': stage_generate,
+    'configfile': stage_configfile,
+    'configfile_cached': stage_configfile_cached,
+    # serialization of already generated charts
+    'write_kubragen': _stage_write(_write_kubragen),
+    'write_yaml': _stage_write(lambda data, fl: write_yaml(data, fl, yaml.SafeDumper)),
+    'write_yaml_c': _stage_write(lambda data, fl: write_yaml(data, fl, YAML_DUMPER)),
+    'write_json': _stage_write(write_json),
+    'write_ndjson': _stage_write(write_ndjson),
+}
+
+
+class Measure:
+    def __init__(self, stage: str, variant: str, releases: int):
+        self.stage = stage
+        self.variant = variant
+        self.releases = releases
+        self.wall = 0.0
+        self.peak = 0
+        self.blocks = 0
+        self.collections = 0
+
+
+def _gc_collections() -> int:
+    return sum(s['collections'] for s in gc.get_stats())
+
+
+def measure(stage: str, variant: str, releases: int, repeat: int) -> Measure:
+    ret = Measure(stage, variant, releases)
+
+    # wall time: best of *repeat*, without tracing
+    walls = []
+    for _ in range(repeat):
+        run = STAGES[stage](variant, releases)
+        gc.collect()
+        collections = _gc_collections()
+        start = time.perf_counter()
+        run()
+        walls.append(time.perf_counter() - start)
+        ret.collections = _gc_collections() - collections
+    ret.wall = min(walls)
+
+    # memory: peak traced memory and blocks still allocated by the result
+    run = STAGES[stage](variant, releases)
+    gc.collect()
+    tracemalloc.start()
+    result = run()
+    ret.peak = tracemalloc.get_traced_memory()[1]
+    ret.blocks = sum(s.count for s in tracemalloc.take_snapshot().statistics('filename'))
+    tracemalloc.stop()
+    del result
+    return ret
+
+
+def measure_build(variant: str, releases: int) -> Measure:
+    ret = Measure('build', variant, releases)
+    timed = _TimedBuildData(hmi_rabbitmq.chart.OptionsBuildData)
+    hmi_rabbitmq.chart.OptionsBuildData = timed  # type: ignore
+    try:
+        stage_generate(variant, releases)()
+    finally:
+        hmi_rabbitmq.chart.OptionsBuildData = timed.func  # type: ignore
+    ret.wall = timed.elapsed
+    return ret
+
+
+def print_header() -> None:
+    print('{:<18} {:<16} {:>8} {:>12} {:>14} {:>12} {:>12} {:>6}'.format(
+        'stage', 'variant', 'releases', 'wall (ms)', 'per rel (us)', 'peak (KiB)', 'blocks', 'gc'))
+
+
+def print_measure(m: Measure) -> None:
+    print('{:<18} {:<16} {:>8} {:>12.2f} {:>14.1f} {:>12} {:>12} {:>6}'.format(
+        m.stage, m.variant, m.releases, m.wall * 1000, m.wall * 1000000 / m.releases,
+        m.peak // 1024 if m.peak else '-', m.blocks if m.blocks else '-', m.collections))
+
+
+def profile(stage: str, variant: str, releases: int, top: int) -> None:
+    run = STAGES[stage](variant, releases)
+    profiler = cProfile.Profile()
+    profiler.runcall(run)
+    pstats.Stats(profiler).sort_stats('cumulative').print_stats(top)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='hmi_rabbitmq benchmarks')
+    parser.add_argument('--releases', type=int, nargs='+', default=[1, 100, 1000])
+    parser.add_argument('--variant', nargs='+', choices=list(VARIANTS.keys()), default=list(VARIANTS.keys()))
+    parser.add_argument('--stage', nargs='+', choices=list(STAGES.keys()) + ['build'],
+                        default=list(STAGES.keys()) + ['build'])
+    parser.add_argument('--repeat', type=int, default=3, help='wall time is the best of REPEAT runs')
+    parser.add_argument('--profile', choices=list(STAGES.keys()), help='profile a stage instead of timing it')
+    parser.add_argument('--top', type=int, default=25, help='number of profile entries to print')
+    args = parser.parse_args(argv)
+
+    if args.profile is not None:
+        for variant in args.variant:
+            for releases in args.releases:
+                print('*** {} {} x{}'.format(args.profile, variant, releases))
+                profile(args.profile, variant, releases, args.top)
+        return
+
+    print_header()
+    for stage in args.stage:
+        for variant in args.variant:
+            for releases in args.releases:
+                if stage == 'build':
+                    print_measure(measure_build(variant, releases))
+                else:
+                    print_measure(measure(stage, variant, releases, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,95 @@
-from .chart import (
-    RabbitMQChartRequest,
-    RabbitMQChart,
-)
-from .configfile import (
-    RabbitMQConfigFile,
-)
+import importlib
+from typing import Any, List, TYPE_CHECKING
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .chart import (
+        RabbitMQChartRequest,
+        RabbitMQChart,
+    )
+    from .configfile import (
+        RabbitMQConfigFile,
+    )
+    from .batch import (
+        RabbitMQBatchItem,
+        RabbitMQBatchResult,
+        generate_batch,
+    )
+    from .incremental import (
+        HashManifest,
+        IncrementalResult,
+        generate_incremental,
+    )
+    from .output import (
+        stream_resources,
+        write_yaml,
+        write_json,
+        write_ndjson,
+        write_resources,
+        write_file,
+    )
+    from .instrumentation import (
+        Instrumentation,
+        StageRecord,
+        StageSummary,
+    )
 
 
 __version__ = "0.8.1"
 
 
+# Submodules are imported on first access, so importing the package (e.g. for the command line) does not pull
+# in helmion, kubragen2 and deepmerge until they are needed.
+_lazy_imports = {
+    'RabbitMQChartRequest': '.chart',
+    'RabbitMQChart': '.chart',
+    'RabbitMQConfigFile': '.configfile',
+    'RabbitMQBatchItem': '.batch',
+    'RabbitMQBatchResult': '.batch',
+    'generate_batch': '.batch',
+    'HashManifest': '.incremental',
+    'IncrementalResult': '.incremental',
+    'generate_incremental': '.incremental',
+    'stream_resources': '.output',
+    'write_yaml': '.output',
+    'write_json': '.output',
+    'write_ndjson': '.output',
+    'write_resources': '.output',
+    'write_file': '.output',
+    'Instrumentation': '.instrumentation',
+    'StageRecord': '.instrumentation',
+    'StageSummary': '.instrumentation',
+}
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _lazy_imports:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    value = getattr(importlib.import_module(_lazy_imports[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> List[str]:
+    return sorted(list(globals().keys()) + list(_lazy_imports.keys()))
+
+
 __all__ = [
     'RabbitMQChartRequest',
     'RabbitMQChart',
     'RabbitMQConfigFile',
+    'RabbitMQBatchItem',
+    'RabbitMQBatchResult',
+    'generate_batch',
+    'HashManifest',
+    'IncrementalResult',
+    'generate_incremental',
+    'stream_resources',
+    'write_yaml',
+    'write_json',
+    'write_ndjson',
+    'write_resources',
+    'write_file',
+    'Instrumentation',
+    'StageRecord',
+    'StageSummary',
 ]
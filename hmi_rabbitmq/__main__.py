@@ -0,0 +1,5 @@
+import sys
+
+from hmi_rabbitmq.cli import main
+
+sys.exit(main())
@@ -0,0 +1,179 @@
+import concurrent.futures
+import os
+import threading
+import time
+from typing import Optional, Mapping, Any, Sequence, List, Iterable, Union, Tuple, Type
+
+from helmion.config import Config
+from kubragen2.exception import InvalidParamError
+
+from hmi_rabbitmq.chart import RabbitMQChartRequest, RabbitMQChart
+from hmi_rabbitmq.instrumentation import Instrumentation
+
+
+class RabbitMQBatchItem:
+    """
+    A single release to be generated by :func:`generate_batch`.
+
+    :param namespace: the release namespace
+    :param releasename: the release name
+    :param values: the release-specific values, merged over the batch common values
+    """
+    namespace: Optional[str]
+    releasename: str
+    values: Optional[Mapping[str, Any]]
+
+    def __init__(self, namespace: Optional[str] = 'default', releasename: str = 'rabbitmq',
+                 values: Optional[Mapping[str, Any]] = None):
+        self.namespace = namespace
+        self.releasename = releasename
+        self.values = values
+
+
+class RabbitMQBatchResult:
+    """
+    The result of generating a single release in :func:`generate_batch`.
+
+    Exactly one of *chart* or *error* is set.
+    """
+    namespace: Optional[str]
+    releasename: str
+    chart: Optional[RabbitMQChart]
+    error: Optional[BaseException]
+    duration: float
+    """the time in seconds spent creating the request and generating the chart"""
+    instrumentation: Optional[Instrumentation]
+    """the stages instrumentation, if enabled in :func:`generate_batch`"""
+
+    def __init__(self, namespace: Optional[str], releasename: str, chart: Optional[RabbitMQChart] = None,
+                 error: Optional[BaseException] = None, duration: float = 0.0,
+                 instrumentation: Optional[Instrumentation] = None):
+        self.namespace = namespace
+        self.releasename = releasename
+        self.chart = chart
+        self.error = error
+        self.duration = duration
+        self.instrumentation = instrumentation
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+BatchItemType = Union[RabbitMQBatchItem, Tuple[Optional[str], str, Optional[Mapping[str, Any]]]]
+"""A :class:`RabbitMQBatchItem` or a (namespace, releasename, values) tuple."""
+
+
+class _BatchContext:
+    """
+    Everything that does not depend on the release, shared by all the releases of a batch.
+
+    The releases are derived from a base request with the common values, which is built once per process.
+    """
+    def __init__(self, request_class: Type[RabbitMQChartRequest], values: Optional[Mapping[str, Any]],
+                 config: Config, instrument: bool = False, trace_memory: bool = False):
+        self.request_class = request_class
+        self.values = values
+        self.config = config
+        self.instrument = instrument
+        self.trace_memory = trace_memory
+        self._base: Optional[RabbitMQChartRequest] = None
+        self._base_lock = threading.Lock()
+
+    def __getstate__(self):
+        # worker processes build their own base request
+        state = self.__dict__.copy()
+        state['_base'] = None
+        del state['_base_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._base_lock = threading.Lock()
+
+    def base(self) -> RabbitMQChartRequest:
+        with self._base_lock:
+            if self._base is None:
+                # without a namespace, so releases without one can be derived from it
+                self._base = self.request_class(namespace=None, values=self.values, config=self.config)
+            return self._base
+
+    def generate(self, item: RabbitMQBatchItem) -> RabbitMQBatchResult:
+        instrumentation = Instrumentation(trace_memory=self.trace_memory) if self.instrument else None
+        start = time.perf_counter()
+        try:
+            req = self.base().derive(values=item.values, namespace=item.namespace, releasename=item.releasename,
+                                     instrumentation=instrumentation)
+            chart = req.generate()
+        except Exception as e:
+            return RabbitMQBatchResult(item.namespace, item.releasename, error=e,
+                                       duration=time.perf_counter() - start, instrumentation=instrumentation)
+        return RabbitMQBatchResult(item.namespace, item.releasename, chart=chart,
+                                   duration=time.perf_counter() - start, instrumentation=instrumentation)
+
+
+def _item(item: BatchItemType) -> RabbitMQBatchItem:
+    if isinstance(item, RabbitMQBatchItem):
+        return item
+    if isinstance(item, Sequence) and len(item) == 3:
+        return RabbitMQBatchItem(namespace=item[0], releasename=item[1], values=item[2])
+    raise InvalidParamError('Invalid batch item: "{}"'.format(repr(item)))
+
+
+_process_context: Optional[_BatchContext] = None
+
+
+def _process_init(context: _BatchContext) -> None:
+    global _process_context
+    _process_context = context
+
+
+def _process_generate(item: RabbitMQBatchItem) -> RabbitMQBatchResult:
+    assert _process_context is not None
+    return _process_context.generate(item)
+
+
+def generate_batch(items: Iterable[BatchItemType], values: Optional[Mapping[str, Any]] = None,
+                   config: Optional[Config] = None, executor: str = 'serial',
+                   max_workers: Optional[int] = None,
+                   request_class: Type[RabbitMQChartRequest] = RabbitMQChartRequest,
+                   instrument: bool = False, trace_memory: bool = False) -> List[RabbitMQBatchResult]:
+    """
+    Generates many releases, optionally in parallel.
+
+    Errors are collected per release in :attr:`RabbitMQBatchResult.error`, so one invalid release does not
+    abort the batch.
+
+    :param items: the releases to generate, as :class:`RabbitMQBatchItem` or (namespace, releasename, values) tuples
+    :param values: values common to all releases, each release values are merged over them
+    :param config: the chart config, shared by all releases
+    :param executor: one of "serial", "thread" or "process". Generation is pure Python, so only "process"
+        runs releases in parallel. With "process", the common values and request class are sent to each worker
+        process only once, and must be picklable.
+    :param max_workers: the maximum number of parallel workers, defaults to the executor default
+    :param request_class: the chart request class to instantiate for each release
+    :param instrument: record the cost of each generation stage in :attr:`RabbitMQBatchResult.instrumentation`.
+        Use :func:`Instrumentation.aggregate` to summarize them.
+    :param trace_memory: also record the traced memory delta of each stage. Not supported with the "thread"
+        executor, as the traced memory is process-wide.
+    :return: the results, in the same order as *items*
+    """
+    if trace_memory and executor == 'thread':
+        raise InvalidParamError('trace_memory is not supported with the "thread" executor')
+    context = _BatchContext(request_class=request_class, values=values,
+                            config=config if config is not None else Config(),
+                            instrument=instrument or trace_memory, trace_memory=trace_memory)
+    batchitems = [_item(item) for item in items]
+
+    if executor == 'serial':
+        return [context.generate(item) for item in batchitems]
+    elif executor == 'thread':
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as tpool:
+            return list(tpool.map(context.generate, batchitems))
+    elif executor == 'process':
+        workers = max_workers if max_workers is not None else (os.cpu_count() or 1)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_process_init,
+                                                    initargs=(context,)) as ppool:
+            # send items in chunks, to reduce the inter-process overhead on large batches
+            return list(ppool.map(_process_generate, batchitems, chunksize=max(1, len(batchitems) // (workers * 4))))
+    raise InvalidParamError('Invalid batch executor: "{}"'.format(executor))
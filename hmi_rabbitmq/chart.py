@@ -1,16 +1,28 @@
-from typing import Optional, Mapping, Any, Sequence, List, Dict
+import contextlib
+import copy
+from typing import Optional, Mapping, Any, Sequence, Dict, Iterator, ContextManager, TextIO
 
 from helmion.chart import Chart
 from helmion.config import Config
 from helmion.data import ChartData
 from kubragen2.configfile import ConfigFileRender_SysCtl, ConfigFileRender_RawStr
 from kubragen2.data import ValueData, Data
+from kubragen2.exception import InvalidParamError
 from kubragen2.kdatahelper import KDataHelper_ConfigFile, KDataHelper_Env
 from kubragen2.merger import merger
 from kubragen2.options import Options, OptionValue, OptionsBuildData
 
+from hmi_rabbitmq import __version__
 from hmi_rabbitmq.configfile import RabbitMQConfigFile
-from hmi_rabbitmq.private.chart import PersistenceData, VolumeClaimTemplate
+from hmi_rabbitmq.instrumentation import Instrumentation, instrument_stage
+from hmi_rabbitmq.private import skeleton
+from hmi_rabbitmq.private.chart import PersistenceData, VolumeClaimTemplate, PodAntiAffinityData, \
+    TopologySpreadData, ProbeData, DetailedMetricsEndpoint, ExtraVolumeClaimTemplate, ExtraClaimVolume, cluster_env, \
+    erlang_args, extra_claim_mount_path, guaranteed_resources, definition_files, pre_stop_command
+from hmi_rabbitmq.private.fingerprint import fingerprint, resource_key
+from hmi_rabbitmq.private.network import pod_sysctls
+from hmi_rabbitmq.output import write_resources
+from hmi_rabbitmq.private.options import ResolvedOptions, OptionsChanges, options_derive
 
 
 class RabbitMQChartRequest:
@@ -21,26 +33,111 @@ class RabbitMQChartRequest:
     namespace: Optional[str]
     releasename: str
     values: Optional[Mapping[str, Any]]
-    _options: Options
+    instrumentation: Optional[Instrumentation]
+    _options: ResolvedOptions
     _serviceaccount: str
 
     def __init__(self, namespace: Optional[str] = 'default', releasename: str = 'rabbitmq',
-                 values: Optional[Mapping[str, Any]] = None, config: Optional[Config] = None):
+                 values: Optional[Mapping[str, Any]] = None, config: Optional[Config] = None,
+                 instrumentation: Optional[Instrumentation] = None):
         self.namespace = namespace
         self.releasename = releasename
         self.values = values
         self.config = config if config is not None else Config()
-        self._options = Options({
-            'base': {
-                'namespace': namespace,
-                'releasename': releasename,
-            },
-        }, self.allowedValues(), self.values)
+        self.instrumentation = instrumentation
+        with self._stage('options'):
+            options = Options({
+                'base': {
+                    'namespace': namespace,
+                    'releasename': releasename,
+                },
+            }, self.allowedValues(), self.values)
+        with self._stage('resolve'):
+            self._options = ResolvedOptions(options)
         self._serviceaccount = self._options.option_get_opt('serviceAccount.name', self.name_format())
 
+    def derive(self, values: Optional[Mapping[str, Any]] = None, namespace: Optional[str] = None,
+               releasename: Optional[str] = None,
+               instrumentation: Optional[Instrumentation] = None) -> 'RabbitMQChartRequest':
+        """
+        Returns a new request with *values* merged over the values of this one, optionally with a different
+        namespace and release name.
+
+        The merged options are not rebuilt from :func:`allowedValues`: the new request shares all options
+        that were not overridden with this one, so its cost is proportional to the size of *values*.
+        The rendered config file is reused too, if its options did not change.
+
+        :param values: the values to merge over the values of this request
+        :param namespace: the new namespace, None to keep the current one
+        :param releasename: the new release name, None to keep the current one
+        :param instrumentation: the instrumentation of the new request
+        :return: the new request
+        """
+        override: Dict[str, Any] = {}
+        if namespace is not None or releasename is not None:
+            override['base'] = {}
+            if namespace is not None:
+                override['base']['namespace'] = namespace
+            if releasename is not None:
+                override['base']['releasename'] = releasename
+        if values is not None:
+            override = merger.merge(override, dict(values))
+
+        ret = copy.copy(self)
+        ret.namespace = namespace if namespace is not None else self.namespace
+        ret.releasename = releasename if releasename is not None else self.releasename
+        if values is not None:
+            ret.values = options_derive(self.values or {}, values, OptionsChanges())
+        ret.instrumentation = instrumentation
+        with ret._stage('options'):
+            changes = OptionsChanges()
+            options = options_derive(self._options.options, override, changes)
+        with ret._stage('resolve'):
+            ret._options = self._options.derive(options, changes)
+        ret._serviceaccount = ret._options.option_get_opt('serviceAccount.name', ret.name_format())
+        return ret
+
     def options(self) -> Options:
+        """
+        Returns the merged options, as a read-only snapshot resolved once per request.
+        """
         return self._options
 
+    def _stage(self, stage: str) -> ContextManager[None]:
+        if self.instrumentation is None:
+            return contextlib.nullcontext()
+        return self.instrumentation.stage(stage, '{}/{}'.format(self.namespace, self.releasename))
+
+    def _definitions_volume(self, definitions: Mapping[str, str],
+                            definitions_configmaps: Mapping[str, str]) -> Mapping[str, Any]:
+        if self._options.option_get('loadDefinition.source') == 'configMap':
+            if self._options.option_get('loadDefinition.existingConfigMap') != '':
+                return {
+                    'name': 'rabbitmq-config-load-definition',
+                    'configMap': {
+                        'name': self._options.option_get('loadDefinition.existingConfigMap'),
+                    },
+                }
+            return {
+                'name': 'rabbitmq-config-load-definition',
+                'projected': {
+                    'sources': [{
+                        'configMap': {
+                            'name': definitions_configmaps[filename],
+                            'items': [{'key': filename, 'path': filename}],
+                        },
+                    } for filename in definitions.keys()],
+                },
+            }
+        return {
+            'name': 'rabbitmq-config-load-definition',
+            'secret': {
+                'secretName': self._options.option_get_opt('loadDefinition.existingSecret', self.name_format('config-secret')),
+                'items': [{'key': filename, 'path': filename} for filename in definitions.keys()]
+                if len(definitions) > 0 else skeleton.load_definition_items(),
+            },
+        }
+
     def allowedValues(self) -> Mapping[str, Any]:
         return {
             'image': {
@@ -49,6 +146,26 @@ class RabbitMQChartRequest:
                 'tag': '3.8.9-alpine',
             },
             'clusterDomain': 'cluster.local',
+            'replicas': 1,
+            'clustering': {
+                'enabled': False,
+                'podManagementPolicy': 'Parallel',
+                'addressType': 'hostname',
+                'podAntiAffinity': 'soft',
+                'topologySpread': {
+                    'enabled': True,
+                    'maxSkew': 1,
+                    'whenUnsatisfiable': 'ScheduleAnyway',
+                    'topologyKeys': {
+                        'zone': 'topology.kubernetes.io/zone',
+                        'node': 'kubernetes.io/hostname',
+                    },
+                },
+                'podDisruptionBudget': {
+                    'enabled': True,
+                    'maxUnavailable': 1,
+                },
+            },
             'auth': {
                 'username': 'user',
                 'password': '',
@@ -66,28 +183,76 @@ class RabbitMQChartRequest:
                 }
             },
             'logs': '-',
+            'configMode': 'initContainer',
+            'checksumAnnotations': True,
+            'upgrade': {
+                'enabled': False,
+                'awaitQuorumPlusOne': True,
+                'awaitSynchronizedMirror': True,
+                'terminationGracePeriodSeconds': 604800,
+                'partition': 0,
+            },
             'memoryHighWatermark': {
                 'enabled': False,
                 'type': 'relative',
                 'value': 0.4,
+                'pagingRatio': None,
+            },
+            'diskFreeLimit': {
+                'enabled': False,
+                'ratio': 0.1,
+                'volumeSize': None,
             },
             'plugins': 'rabbitmq_management rabbitmq_peer_discovery_k8s',
             'extraPlugins': '',
             'loadDefinition': {
                 'enabled': False,
+                'source': 'secret',
                 'existingSecret': '',
+                'existingConfigMap': '',
                 'value': '',
+                'shards': {},
+                'skipIfUnchanged': False,
+                'hashingAlgorithm': 'sha256',
             },
             'extraEnvVars': [],
             'configuration': '',
             'extraConfiguration': '',
+            'advancedConfiguration': '',
+            'erlang': {
+                'schedulers': None,
+                'schedulerBusyWait': None,
+                'asyncThreads': None,
+                'processLimit': None,
+                'distributionBufferSize': None,
+                'extraArgs': '',
+            },
+            'performanceProfile': '',
+            'network': {
+                'backlog': None,
+                'sndbuf': None,
+                'recbuf': None,
+                'nodelay': None,
+                'acceptors': {
+                    'tcp': None,
+                    'ssl': None,
+                },
+                'heartbeat': None,
+                'sysctls': {},
+            },
             'serviceAccount': {
                 'create': True,
                 'name': '',
             },
             'livenessProbe': {
                 'enabled': True,
-                'initialDelaySeconds': 120,
+                'mode': 'exec',
+                'tcpPort': 'amqp',
+                'httpPath': '/',
+                'httpPort': 'http-stats',
+                # None is 0 with the startupProbe, which holds the liveness probe until the broker started,
+                # otherwise 120
+                'initialDelaySeconds': None,
                 'timeoutSeconds': 20,
                 'periodSeconds': 30,
                 'failureThreshold': 6,
@@ -95,12 +260,28 @@ class RabbitMQChartRequest:
             },
             'readinessProbe': {
                 'enabled': True,
+                'mode': 'exec',
+                'tcpPort': 'amqp',
+                'httpPath': '/',
+                'httpPort': 'http-stats',
                 'initialDelaySeconds': 10,
                 'timeoutSeconds': 20,
                 'periodSeconds': 30,
                 'failureThreshold': 3,
                 'successThreshold': 1,
             },
+            'startupProbe': {
+                'enabled': False,
+                'mode': 'diagnostics',
+                'tcpPort': 'amqp',
+                'httpPath': '/',
+                'httpPort': 'http-stats',
+                'initialDelaySeconds': 10,
+                'timeoutSeconds': 20,
+                'periodSeconds': 10,
+                'failureThreshold': 30,
+                'successThreshold': 1,
+            },
             'rbac': {
                 'create': True,
             },
@@ -111,6 +292,9 @@ class RabbitMQChartRequest:
                 'accessMode': 'ReadWriteOnce',
                 'existingClaim': '',
                 'size': '8Gi',
+                'fsGroupChangePolicy': 'OnRootMismatch',
+                'extraClaims': {},
+                'walClaim': '',
             },
             'service': {
                 'type': 'ClusterIP',
@@ -125,9 +309,23 @@ class RabbitMQChartRequest:
                 'epmdPort': 4369,
                 'epmdPortName': 'epmd',
             },
+            'stream': {
+                'enabled': False,
+                'plugin': 'rabbitmq_stream',
+                'port': 5552,
+                'portName': 'stream',
+                'advertisedHost': '',
+                'advertisedPort': None,
+                'initialCredits': 50000,
+                'creditsRequiredForUnblocking': 12500,
+                'frameMax': 1048576,
+                'heartbeat': 60,
+            },
             'metrics': {
                 'enabled': False,
                 'plugins': 'rabbitmq_prometheus',
+                'returnPerObjectMetrics': False,
+                'disableMetricsCollector': False,
                 'podAnnotations': {
                     'prometheus.io/scrape': 'true',
                     'prometheus.io/port': OptionValue('service.metricsPort', wrap_type=str),
@@ -136,11 +334,35 @@ class RabbitMQChartRequest:
                     'enabled': False,
                     'interval': '30s',
                     'labels': {},
+                    'metricRelabelings': [],
+                    'detailed': {},
                 }
             },
             'resources': None,
+            'placement': {
+                'guaranteedQoS': False,
+                'priorityClassName': '',
+                'nodeSelector': {},
+                'tolerations': [],
+            },
         }
 
+    def fingerprint(self) -> str:
+        """
+        Returns a stable hash of everything the generated chart depends on, without generating it.
+
+        It includes the package version, as a new version may generate different resources from the same options.
+
+        :raises InvalidParamError: if the options contain values that can't be hashed, like functions
+        """
+        return fingerprint({
+            'class': '{}.{}'.format(type(self).__module__, type(self).__qualname__),
+            'version': __version__,
+            'namespace': self.namespace,
+            'releasename': self.releasename,
+            'options': self._options.options,
+        })
+
     def name_format(self, suffix: str = ''):
         ret = self.releasename
         if suffix != '':
@@ -148,37 +370,115 @@ class RabbitMQChartRequest:
         return ret
 
     def generate(self) -> Chart:
+        """
+        Generates the chart, with all its resources.
+        """
+        return RabbitMQChart(request=self, config=self.config, data=list(self.generate_iter()))
+
+    def generate_iter(self) -> Iterator[ChartData]:
+        """
+        Generates the chart resources one at a time. Each resource is fully built before being yielded,
+        and the next one is only created when requested.
+        """
+        resources = self.generate_data()
+        while True:
+            # the stages must not be active while the caller consumes the resource
+            with self._stage('resources'):
+                data = next(resources, None)
+            if data is None:
+                return
+            with self._stage('build'):
+                data = OptionsBuildData(self._options, data)
+            yield data
+
+    def generate_data(self) -> Iterator[ChartData]:
+        """
+        Generates the chart resources before the build step, which may still contain
+        :class:`kubragen2.data.Data` and :class:`kubragen2.option.Option` instances.
+        """
         namespace_value = ValueData(self.namespace, enabled=self.namespace is not None)
+        name = self.name_format()
+        metrics_enabled = self._options.option_get('metrics.enabled')
 
-        data: List[ChartData] = []
+        replicas = self._options.option_get('replicas')
+        if not isinstance(replicas, int) or replicas < 1:
+            raise InvalidParamError('Invalid replicas: "{}"'.format(replicas))
+        # the node names and the pod management policy can't change after the release is created, so they don't
+        # follow the replica count, which may be scaled later
+        clustered = self._options.option_get('clustering.enabled')
+        if replicas > 1 and not clustered:
+            raise InvalidParamError('clustering.enabled is required for more than one replica')
+        if clustered and self.namespace is None:
+            raise InvalidParamError('A namespace is required when clustering is enabled')
+        address_type = self._options.option_get('clustering.addressType')
+        if address_type not in ('hostname', 'ip'):
+            raise InvalidParamError('Invalid clustering.addressType: "{}"'.format(address_type))
+        advanced_config = self._options.option_get('advancedConfiguration') != ''
+        config_mode = self._options.option_get('configMode')
+        if config_mode not in ('initContainer', 'projected'):
+            raise InvalidParamError('Invalid configMode: "{}"'.format(config_mode))
+        init_container = config_mode == 'initContainer'
+        extra_claims = list(self._options.option_get('persistence.extraClaims').keys())
+        stream_enabled = self._options.option_get('stream.enabled')
+        stream_port = self._options.option_get('stream.port') if stream_enabled else None
+        # without a fixed advertised host, each pod advertises its name in the headless service domain
+        stream_pod_host = stream_enabled and self._options.option_get('stream.advertisedHost') == ''
+        if stream_pod_host and not init_container:
+            raise InvalidParamError('stream.advertisedHost is required when configMode is "{}"'.format(config_mode))
+        if stream_pod_host and self.namespace is None:
+            raise InvalidParamError('stream.advertisedHost is required without a namespace')
+        if self._options.option_get('placement.guaranteedQoS'):
+            resources = guaranteed_resources(self._options)
+            # a shared dict would be written as a YAML anchor and alias
+            init_resources = copy.deepcopy(resources)
+        else:
+            resources = self._options.option_get('resources')
+            init_resources = None
+        definitions_source = None
+        definitions: Dict[str, str] = {}
+        definitions_configmaps: Dict[str, str] = {}
+        if self._options.option_get('loadDefinition.enabled'):
+            definitions_source = self._options.option_get('loadDefinition.source')
+            if definitions_source not in ('secret', 'configMap'):
+                raise InvalidParamError('Invalid loadDefinition.source: "{}"'.format(definitions_source))
+            definitions = definition_files(self._options)
+            definitions_configmaps = {filename: self.name_format('load-definition-{}'.format(
+                filename[:-len('.json')].replace('_', '-'))) for filename in definitions.keys()}
+        pod_security_context = skeleton.pod_security_context(
+            self._options.option_get('persistence.fsGroupChangePolicy'))
+        sysctls = pod_sysctls(self._options)
+        if len(sysctls) > 0:
+            pod_security_context = {**pod_security_context, 'sysctls': sysctls}
+        upgrade_enabled = self._options.option_get('upgrade.enabled')
+        erlang_secret = self._options.option_get_opt('auth.existingErlangSecret', self.name_format('config-secret'))
+        erl_args = erlang_args(self._options)
 
         if self._options.option_get('serviceAccount.create'):
-            data.append({
+            yield {
                 'apiVersion': 'v1',
                 'kind': 'ServiceAccount',
                 'metadata': {
                     'name': self._serviceaccount,
                     'namespace': namespace_value,
                 }
-            })
+            }
 
         if self._options.option_get('rbac.create'):
-            data.extend([
+            yield from [
                 {
                     'kind': 'Role',
                     'apiVersion': 'rbac.authorization.k8s.io/v1beta1',
                     'metadata': {
-                        'name': self.name_format(),
+                        'name': name,
                         'namespace': namespace_value,
                     },
-                    'rules': [{'apiGroups': [''], 'resources': ['endpoints'], 'verbs': ['get']},
-                        {'apiGroups': [''], 'resources': ['events'], 'verbs': ['create']}]
+                    'rules': skeleton.rbac_rules(),
                 },
                 {
                     'kind': 'RoleBinding',
                     'apiVersion': 'rbac.authorization.k8s.io/v1beta1',
                     'metadata': {
-                        'name': self.name_format(),
+                        'name': name,
                         'namespace': namespace_value,
                     },
                     'subjects': [{
@@ -188,42 +488,57 @@ class RabbitMQChartRequest:
                     'roleRef': {
                         'apiGroup': 'rbac.authorization.k8s.io',
                         'kind': 'Role',
-                        'name': self.name_format(),
+                        'name': name,
                     }
                 },
-            ])
+            ]
 
-        plugins = set(self._options.option_get('plugins').split(' '))
-        if self._options.option_get('extraPlugins') != '':
-            plugins.update(self._options.option_get('extraPlugins').split(' '))
-        if self._options.option_get('metrics.enabled'):
-            plugins.add(self._options.option_get('metrics.plugins'))
+        # a dict keeps the declaration order, so the output is stable between runs
+        plugins: Dict[str, None] = dict.fromkeys(self._options.option_get('plugins').split(' '))
+        extra_plugins = self._options.option_get('extraPlugins')
+        if extra_plugins != '':
+            plugins.update(dict.fromkeys(extra_plugins.split(' ')))
+        if metrics_enabled:
+            plugins[self._options.option_get('metrics.plugins')] = None
+        if stream_enabled:
+            plugins[self._options.option_get('stream.plugin')] = None
 
-        data.append({
+        with instrument_stage('configfile'):
+            configuration = self._options.option_get_opt('configuration', RabbitMQConfigFile())
+            configrenderers = [
+                ConfigFileRender_SysCtl(),
+                ConfigFileRender_RawStr()
+            ]
+            if isinstance(configuration, RabbitMQConfigFile):
+                configfile = configuration.render(self._options, configrenderers)
+            else:
+                configfile = KDataHelper_ConfigFile.info(configuration, self._options, configrenderers)
+
+        config_data = {
+            'enabled_plugins': '[{}].'.format(', '.join(plugins)),
+            'rabbitmq.conf': configfile,
+        }
+        if advanced_config:
+            config_data['advanced.config'] = self._options.option_get('advancedConfiguration')
+
+        yield {
             'apiVersion': 'v1',
             'kind': 'ConfigMap',
             'metadata': {
                 'name': self.name_format('config'),
                 'namespace': namespace_value,
             },
-            'data': {
-                'enabled_plugins': '[{}].'.format(', '.join(plugins)),
-                'rabbitmq.conf': KDataHelper_ConfigFile.info(self._options.option_get_opt(
-                    'configuration', RabbitMQConfigFile()), self._options, [
-                    ConfigFileRender_SysCtl(),
-                    ConfigFileRender_RawStr()
-                ]),
-            }
-        })
+            'data': config_data,
+        }
 
         config_secret = {}
         if self._options.option_get('auth.existingErlangSecret') == '':
             config_secret['rabbitmq-erlang-cookie'] = self._options.option_get('auth.erlangCookie')
 
-        if self._options.option_get('loadDefinition.enabled') and self._options.option_get('loadDefinition.existingSecret') == '':
-            config_secret['load_definition.json'] = self._options.option_get('loadDefinition.value')
+        if definitions_source == 'secret' and self._options.option_get('loadDefinition.existingSecret') == '':
+            config_secret.update(definitions)
 
-        data.append({
+        yield {
             'apiVersion': 'v1',
             'kind': 'Secret',
             'metadata': {
@@ -231,10 +546,34 @@ class RabbitMQChartRequest:
                 'namespace': namespace_value,
             },
             'type': 'Opaque',
-            'data': config_secret,
-        })
+            # "data" would require the values to be base64 encoded
+            'stringData': config_secret,
+        }
 
-        data.extend([
+        if definitions_source == 'configMap' and self._options.option_get('loadDefinition.existingConfigMap') == '':
+            # one ConfigMap per file, so large definition sets are not limited by the ConfigMap size limit
+            for filename, value in definitions.items():
+                yield {
+                    'apiVersion': 'v1',
+                    'kind': 'ConfigMap',
+                    'metadata': {
+                        'name': definitions_configmaps[filename],
+                        'namespace': namespace_value,
+                    },
+                    'data': {
+                        filename: value,
+                    },
+                }
+
+        # the pod template changes, and the pods are rolled, only when the config they use changes
+        checksums: Dict[str, str] = {}
+        if self._options.option_get('checksumAnnotations'):
+            checksums['checksum/config'] = fingerprint(config_data)
+            checksums['checksum/secret'] = fingerprint(config_secret)
+            if definitions_source == 'configMap':
+                checksums['checksum/definitions'] = fingerprint(definitions)
+
+        yield from [
             {
                 'apiVersion': 'v1',
                 'kind': 'Service',
@@ -243,224 +582,188 @@ class RabbitMQChartRequest:
                     'namespace': namespace_value,
                     'labels': {
                         'app.kubernetes.io/name': 'rabbitmq',
-                        'app.kubernetes.io/instance': self.name_format(),
+                        'app.kubernetes.io/instance': name,
                     },
                 },
                 'spec': {
                     'clusterIP': 'None',
-                    'ports': [{
-                        'name': 'epmd',
-                        'port': 4369,
-                        'protocol': 'TCP',
-                        'targetPort': 4369
-                    },
-                    {
-                        'name': 'cluster-links',
-                        'port': 25672,
-                        'protocol': 'TCP',
-                        'targetPort': 25672
-                    }],
+                    'ports': skeleton.headless_ports(stream_port),
                     'selector': {
                         'app.kubernetes.io/name': 'rabbitmq',
-                        'app.kubernetes.io/instance': self.name_format(),
+                        'app.kubernetes.io/instance': name,
                     },
                     'type': 'ClusterIP',
-                    'sessionAffinity': 'None'
+                    'sessionAffinity': 'None',
+                    # peer discovery must find the pods before they are ready
+                    'publishNotReadyAddresses': ValueData(True, enabled=clustered),
                 }
             },
             {
                 'apiVersion': 'apps/v1',
                 'kind': 'StatefulSet',
                 'metadata': {
-                    'name': self.name_format(),
+                    'name': name,
                     'namespace': namespace_value,
                     'labels': {
                         'app.kubernetes.io/name': 'rabbitmq',
-                        'app.kubernetes.io/instance': self.name_format(),
+                        'app.kubernetes.io/instance': name,
                     },
                 },
                 'spec': {
                     'selector': {
                         'matchLabels': {
                             'app.kubernetes.io/name': 'rabbitmq',
-                            'app.kubernetes.io/instance': self.name_format(),
+                            'app.kubernetes.io/instance': name,
                         }
                     },
                     'serviceName': self.name_format('headless'),
-                    'replicas': 1,
+                    'replicas': replicas,
+                    'updateStrategy': ValueData({
+                        'type': 'RollingUpdate',
+                        'rollingUpdate': {
+                            # pods with an ordinal below the partition keep the current version
+                            'partition': self._options.option_get('upgrade.partition'),
+                        },
+                    }, enabled=upgrade_enabled),
+                    'podManagementPolicy': ValueData(self._options.option_get('clustering.podManagementPolicy'),
+                                                     enabled=clustered),
                     'template': {
                         'metadata': {
                             'namespace': namespace_value,
                             'labels': {
                                 'app.kubernetes.io/name': 'rabbitmq',
-                                'app.kubernetes.io/instance': self.name_format(),
+                                'app.kubernetes.io/instance': name,
+                            },
+                            'annotations': {
+                                **self._options.option_get('metrics.podAnnotations'),
+                                **checksums,
                             },
-                            'annotations': self._options.option_get('metrics.podAnnotations'),
                         },
                         'spec': {
-                            'initContainers': [{
+                            'initContainers': ValueData([{
                                 'name': 'rabbitmq-config',
                                 'image': 'busybox:1.32.0',
-                                'securityContext': {
-                                    'runAsUser': 0,
-                                    'runAsGroup': 0
-                                },
-                                'volumeMounts': [{
-                                    'name': 'rabbitmq-config',
-                                    'mountPath': '/tmp/rabbitmq'
-                                },
-                                {
-                                    'name': 'rabbitmq-config-rw',
-                                    'mountPath': '/etc/rabbitmq'
-                                },
-                                {
-                                    'name': 'rabbitmq-config-erlang-cookie',
-                                    'mountPath': '/tmp/rabbitmq-cookie'
-                                }],
-                                'command': ['sh',
-                                            '-c',
-                                            'cp '
-                                            '/tmp/rabbitmq/rabbitmq.conf '
-                                            '/etc/rabbitmq/rabbitmq.conf '
-                                            "&& echo '' "
-                                            '>> '
-                                            '/etc/rabbitmq/rabbitmq.conf; '
-                                            'cp '
-                                            '/tmp/rabbitmq/enabled_plugins '
-                                            '/etc/rabbitmq/enabled_plugins; '
-                                            'mkdir -p '
-                                            '/var/lib/rabbitmq; '
-                                            'cp '
-                                            '/tmp/rabbitmq-cookie/rabbitmq-erlang-cookie '
-                                            '/var/lib/rabbitmq/.erlang.cookie; '
-                                            'chmod 600 '
-                                            '/var/lib/rabbitmq/.erlang.cookie; '
-                                            'chown '
-                                            '999.999 '
-                                            '/etc/rabbitmq/rabbitmq.conf '
-                                            '/etc/rabbitmq/enabled_plugins '
-                                            '/var/lib/rabbitmq '
-                                            '/var/lib/rabbitmq/.erlang.cookie']
-                            }],
+                                'securityContext': skeleton.init_security_context(),
+                                'volumeMounts': skeleton.init_volume_mounts(),
+                                'command': skeleton.init_command(advanced_config, stream_pod_host),
+                                'resources': ValueData(init_resources, disabled_if_none=True),
+                                'env': ValueData([{
+                                    'name': 'STREAM_ADVERTISED_HOST_SUFFIX',
+                                    'value': '.{}.{}.svc.{}'.format(self.name_format('headless'), self.namespace,
+                                                                    self._options.option_get('clusterDomain')),
+                                }], enabled=stream_pod_host),
+                            }], enabled=init_container),
                             'volumes': [
-                                {
+                                ValueData({
                                     'name': 'rabbitmq-config',
                                     'configMap': {
                                         'name': self.name_format('config'),
                                         'optional': False,
-                                        'items': [{
-                                            'key': 'enabled_plugins',
-                                            'path': 'enabled_plugins'
-                                        },
-                                        {
-                                            'key': 'rabbitmq.conf',
-                                            'path': 'rabbitmq.conf'
-                                        }]
+                                        'items': skeleton.config_items(advanced_config),
                                     }
-                                },
-                                {
-                                    'name': 'rabbitmq-config-rw',
-                                    'emptyDir': {}
-                                },
-                                {
-                                    'name': 'rabbitmq-config-erlang-cookie',
-                                    'secret': {
-                                        'secretName': self._options.option_get_opt('auth.existingErlangSecret', self.name_format('config-secret')),
-                                        'items': [{
-                                            'key': 'rabbitmq-erlang-cookie',
-                                            'path': 'rabbitmq-erlang-cookie',
-                                        }]
+                                }, enabled=init_container),
+                                ValueData({
+                                    'name': 'rabbitmq-config',
+                                    'projected': {
+                                        'defaultMode': 0o444,
+                                        'sources': [{
+                                            'configMap': {
+                                                'name': self.name_format('config'),
+                                                'optional': False,
+                                                'items': skeleton.config_items(advanced_config),
+                                            },
+                                        }],
                                     },
-                                },
+                                }, enabled=not init_container),
+                                skeleton.config_rw_volume(),
                                 ValueData({
-                                    'name': 'rabbitmq-config-load-definition',
+                                    'name': 'rabbitmq-config-erlang-cookie',
                                     'secret': {
-                                        'secretName': self._options.option_get_opt('loadDefinition.existingSecret', self.name_format('config-secret')),
-                                        'items': [{
-                                            'key': 'load_definition.json',
-                                            'path': 'load_definition.json',
-                                        }]
+                                        'secretName': erlang_secret,
+                                        'items': skeleton.erlang_cookie_items(),
                                     },
-                                }, enabled=self._options.option_get('loadDefinition.enabled')),
+                                }, enabled=init_container),
+                                ValueData(self._definitions_volume(definitions, definitions_configmaps),
+                                          enabled=definitions_source is not None),
                                 PersistenceData(name='rabbitmq-data', options=self._options),
+                                *[ExtraClaimVolume(claim, options=self._options) for claim in extra_claims],
                             ],
                             'serviceAccountName': self._serviceaccount,
-                            'securityContext': {
-                                'fsGroup': 999,
-                                'runAsUser': 999,
-                                'runAsGroup': 999
-                            },
+                            'terminationGracePeriodSeconds': ValueData(
+                                self._options.option_get('upgrade.terminationGracePeriodSeconds'),
+                                enabled=upgrade_enabled),
+                            'priorityClassName': ValueData(self._options.option_get('placement.priorityClassName'),
+                                                           enabled=self._options.option_get('placement.priorityClassName') != ''),
+                            'nodeSelector': ValueData(self._options.option_get('placement.nodeSelector'),
+                                                      enabled=len(self._options.option_get('placement.nodeSelector')) > 0),
+                            'tolerations': ValueData(self._options.option_get('placement.tolerations'),
+                                                     enabled=len(self._options.option_get('placement.tolerations')) > 0),
+                            'securityContext': pod_security_context,
+                            'affinity': PodAntiAffinityData(options=self._options),
+                            'topologySpreadConstraints': TopologySpreadData(options=self._options),
                             'containers': [{
                                 'name': 'rabbitmq',
                                 'image': '{}/{}:{}'.format(self._options.option_get('image.registry'),
                                                            self._options.option_get('image.repository'),
                                                            self._options.option_get('image.tag')),
                                 'env': [
+                                    *(cluster_env(address_type, '{}.{}.svc.{}'.format(
+                                        self.name_format('headless'), self.namespace,
+                                        self._options.option_get('clusterDomain'))) if clustered else []),
+                                    ValueData({
+                                        'name': 'RABBITMQ_SERVER_ADDITIONAL_ERL_ARGS',
+                                        'value': erl_args,
+                                    }, enabled=erl_args != ''),
+                                    # the Erlang cookie file must be readable by its owner only, which a mounted
+                                    # file owned by root can't be, so use the environment variable
+                                    *(skeleton.projected_config_env(advanced_config) if not init_container else []),
+                                    ValueData({
+                                        'name': 'RABBITMQ_ERLANG_COOKIE',
+                                        'valueFrom': {
+                                            'secretKeyRef': {
+                                                'name': erlang_secret,
+                                                'key': 'rabbitmq-erlang-cookie',
+                                            },
+                                        },
+                                    }, enabled=not init_container),
                                     *KDataHelper_Env.list(self._options.option_get('extraEnvVars')),
                                 ],
-                                'volumeMounts': [{
-                                    'name': 'rabbitmq-config-rw',
-                                    'mountPath': '/etc/rabbitmq'
-                                },
-                                {
-                                    'name': 'rabbitmq-data',
-                                    'mountPath': '/var/lib/rabbitmq/mnesia'
-                                }, {
-                                    'name': 'rabbitmq-config-load-definition',
-                                    'mountPath': '/etc/rabbitmq-load-definition',
-                                    'readOnly': True,
-                                }],
-                                'ports': [{
-                                    'name': 'amqp',
-                                    'containerPort': 5672,
-                                    'protocol': 'TCP'
-                                },
-                                ValueData({
-                                    'name': 'amqp-ssl',
-                                    'containerPort': 5671,
-                                    'protocol': 'TCP'
-                                }, enabled=self._options.option_get('auth.tls.enabled')),
-                                {
-                                    'name': 'http-stats',
-                                    'containerPort': 15672,
-                                    'protocol': 'TCP'
-                                },
-                                {
-                                    'name': 'metrics',
-                                    'containerPort': 15692,
-                                    'protocol': 'TCP'
-                                },
-                                {
-                                    'name': 'epmd',
-                                    'containerPort': 4369,
-                                    'protocol': 'TCP'
-                                }],
-                                'livenessProbe': ValueData({
-                                    'exec': {
-                                        'command': ['rabbitmq-diagnostics', 'status']
-                                    },
-                                    'initialDelaySeconds': self._options.option_get('livenessProbe.initialDelaySeconds'),
-                                    'periodSeconds': self._options.option_get('livenessProbe.timeoutSeconds'),
-                                    'timeoutSeconds': self._options.option_get('livenessProbe.periodSeconds'),
-                                    'failureThreshold': self._options.option_get('livenessProbe.failureThreshold'),
-                                    'successThreshold': self._options.option_get('livenessProbe.successThreshold'),
-                                }, enabled=self._options.option_get('livenessProbe.enabled')),
-                                'readinessProbe': ValueData({
-                                    'exec': {
-                                        'command': ['rabbitmq-diagnostics', 'ping']
+                                'volumeMounts': [
+                                    *skeleton.container_volume_mounts(),
+                                    ValueData({
+                                        'name': 'rabbitmq-config',
+                                        'mountPath': '/etc/rabbitmq-config',
+                                        'readOnly': True,
+                                    }, enabled=not init_container),
+                                    *[{
+                                        'name': 'rabbitmq-{}'.format(claim),
+                                        'mountPath': extra_claim_mount_path(self._options, claim),
+                                    } for claim in extra_claims],
+                                ],
+                                'lifecycle': ValueData({
+                                    'preStop': {
+                                        'exec': {
+                                            'command': pre_stop_command(self._options),
+                                        },
                                     },
-                                    'initialDelaySeconds': self._options.option_get('readinessProbe.initialDelaySeconds'),
-                                    'periodSeconds': self._options.option_get('readinessProbe.timeoutSeconds'),
-                                    'timeoutSeconds': self._options.option_get('readinessProbe.periodSeconds'),
-                                    'failureThreshold': self._options.option_get('readinessProbe.failureThreshold'),
-                                    'successThreshold': self._options.option_get('readinessProbe.successThreshold'),
-                                }, enabled=self._options.option_get('readinessProbe.enabled')),
-                                'resources': ValueData(self._options.option_get('resources'), disabled_if_none=True),
+                                }, enabled=upgrade_enabled),
+                                'ports': skeleton.container_ports(self._options.option_get('auth.tls.enabled'),
+                                                                  stream_port),
+                                'startupProbe': ProbeData('startupProbe', options=self._options,
+                                                          command=skeleton.port_connectivity_command()),
+                                'livenessProbe': ProbeData('livenessProbe', options=self._options,
+                                                           command=skeleton.liveness_command(),
+                                                           default_initial_delay=0 if self._options.option_get(
+                                                               'startupProbe.enabled') else 120),
+                                'readinessProbe': ProbeData('readinessProbe', options=self._options,
+                                                            command=skeleton.readiness_command()),
+                                'resources': ValueData(resources, disabled_if_none=True),
                             }]
                         }
                     },
                     'volumeClaimTemplates': [
                         VolumeClaimTemplate(name='rabbitmq-data', options=self._options),
+                        *[ExtraVolumeClaimTemplate(claim, options=self._options) for claim in extra_claims],
                     ],
                 },
             },
@@ -472,7 +775,7 @@ class RabbitMQChartRequest:
                     'namespace': namespace_value,
                     'labels': {
                         'app.kubernetes.io/name': 'rabbitmq',
-                        'app.kubernetes.io/instance': self.name_format(),
+                        'app.kubernetes.io/instance': name,
                     },
                 },
                 'spec': {
@@ -492,54 +795,92 @@ class RabbitMQChartRequest:
                         'protocol': 'TCP',
                         'port': self._options.option_get('service.metricsPort'),
                         'targetPort': 'metrics',
-                    }, enabled=self._options.option_get('metrics.enabled')), {
+                    }, enabled=metrics_enabled), {
                         'name': self._options.option_get('service.portName'),
                         'protocol': 'TCP',
                         'port': self._options.option_get('service.port'),
                         'targetPort': 'amqp',
-                    }],
+                    }, ValueData({
+                        'name': self._options.option_get('stream.portName'),
+                        'protocol': 'TCP',
+                        'port': self._options.option_get('stream.port'),
+                        'targetPort': 'stream',
+                    }, enabled=stream_enabled)],
                     'selector': {
                         'app.kubernetes.io/name': 'rabbitmq',
-                        'app.kubernetes.io/instance': self.name_format(),
+                        'app.kubernetes.io/instance': name,
                     }
                 }
             },
-        ])
+        ]
 
-        if self._options.option_get('metrics.enabled') and self._options.option_get('metrics.serviceMonitor.enabled'):
-            data.append({
+        if clustered and self._options.option_get('clustering.podDisruptionBudget.enabled'):
+            yield {
+                'apiVersion': 'policy/v1',
+                'kind': 'PodDisruptionBudget',
+                'metadata': {
+                    'name': name,
+                    'namespace': namespace_value,
+                    'labels': {
+                        'app.kubernetes.io/name': 'rabbitmq',
+                        'app.kubernetes.io/instance': name,
+                    },
+                },
+                'spec': {
+                    'maxUnavailable': self._options.option_get('clustering.podDisruptionBudget.maxUnavailable'),
+                    'selector': {
+                        'matchLabels': {
+                            'app.kubernetes.io/name': 'rabbitmq',
+                            'app.kubernetes.io/instance': name,
+                        }
+                    }
+                }
+            }
+
+        if metrics_enabled and self._options.option_get('metrics.serviceMonitor.enabled'):
+            yield {
                 'apiVersion': 'monitoring.coreos.com/v1',
                 'kind': 'ServiceMonitor',
                 'metadata': {
-                    'name': self.name_format(),
+                    'name': name,
                     'namespace': namespace_value,
                     'labels': merger.merge({
                         'app.kubernetes.io/name': 'rabbitmq',
-                        'app.kubernetes.io/instance': self.name_format(),
+                        'app.kubernetes.io/instance': name,
                     }, self._options.option_get('metrics.serviceMonitor.labels')),
                 },
                 'spec': {
-                    'endpoints': [{
-                        'port': 'metrics',
-                        'interval': self._options.option_get('metrics.serviceMonitor.interval'),
-                    }],
+                    'endpoints': [
+                        {
+                            'port': 'metrics',
+                            'interval': self._options.option_get('metrics.serviceMonitor.interval'),
+                            'metricRelabelings': ValueData(
+                                self._options.option_get('metrics.serviceMonitor.metricRelabelings'),
+                                enabled=len(self._options.option_get('metrics.serviceMonitor.metricRelabelings')) > 0),
+                        },
+                        *[DetailedMetricsEndpoint(endpoint, options=self._options)
+                          for endpoint in self._options.option_get('metrics.serviceMonitor.detailed').keys()],
+                    ],
                     'namespaceSelector': {
                         'matchNames': [namespace_value]
                     },
                     'selector': {
                         'matchLabels': {
                             'app.kubernetes.io/name': 'rabbitmq',
-                            'app.kubernetes.io/instance': self.name_format(),
+                            'app.kubernetes.io/instance': name,
                         }
                     }
                 }
-            })
-
-        return RabbitMQChart(request=self, config=self.config,
-                             data=OptionsBuildData(self._options, data))
+            }
 
 
 class RabbitMQChart(Chart):
+    """
+    The chart generated by :class:`RabbitMQChartRequest`.
+
+    The static parts of the resources, like port lists, volume items and commands, are shared between all charts
+    and must be treated as read-only. Use :func:`clone` to get a copy that can be changed in-place.
+    """
     request: RabbitMQChartRequest
 
     def __init__(self, request: RabbitMQChartRequest, config: Optional[Config] = None,
@@ -547,5 +888,23 @@ class RabbitMQChart(Chart):
         super().__init__(config=config, data=data)
         self.request = request
 
+    def resource_hashes(self) -> Dict[str, str]:
+        """
+        Returns a stable content hash of each resource, keyed by "apiVersion/kind/namespace/name".
+        """
+        return {resource_key(d): fingerprint(d) for d in self.data}
+
+    def write(self, stream: TextIO, format: str = 'yaml') -> int:
+        """
+        Writes the resources to a stream, in the "yaml", "json" or "ndjson" format.
+
+        YAML uses the libyaml C emitter when available. See :func:`hmi_rabbitmq.output.write_resources`.
+
+        :param stream: the output text stream
+        :param format: the output format
+        :return: the number of resources written
+        """
+        return write_resources(self.data, stream, format)
+
     def createClone(self) -> 'Chart':
         return RabbitMQChart(request=self.request, config=self.config)
@@ -0,0 +1,139 @@
+"""
+Command line interface.
+
+Only the standard library is imported at module level, so ``--help`` does not load the chart dependencies.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+
+def _expand_files(patterns: Sequence[str]) -> List[str]:
+    # the shell does not expand wildcards on all platforms
+    ret: List[str] = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            ret.extend(sorted(glob.glob(pattern)))
+        else:
+            ret.append(pattern)
+    return ret
+
+
+def load_values_file(filename: str, namespace: Optional[str]) -> Tuple[Optional[str], str, Mapping[str, Any]]:
+    """
+    Loads a YAML values file.
+
+    The optional top-level *namespace* and *releasename* keys set the release namespace and name, and are not
+    chart values. The release name defaults to the file name without extension. A *configuration* mapping is
+    used as the *merge_config* of a :class:`hmi_rabbitmq.RabbitMQConfigFile`.
+
+    :param filename: the values file name
+    :param namespace: the namespace to use if the file does not set one
+    :return: a (namespace, releasename, values) tuple
+    """
+    import yaml
+    from hmi_rabbitmq.configfile import RabbitMQConfigFile
+
+    with open(filename, 'r', encoding='utf-8') as fl:
+        values = yaml.safe_load(fl)
+    if values is None:
+        values = {}
+    if not isinstance(values, Mapping):
+        raise ValueError('Values file must contain a mapping: "{}"'.format(filename))
+    values = dict(values)
+    namespace = values.pop('namespace', namespace)
+    releasename = values.pop('releasename', os.path.splitext(os.path.basename(filename))[0])
+    if isinstance(values.get('configuration'), Mapping):
+        values['configuration'] = RabbitMQConfigFile(merge_config=values['configuration'])
+    return namespace, releasename, values
+
+
+def render(args: argparse.Namespace) -> int:
+    from hmi_rabbitmq.batch import generate_batch
+    from hmi_rabbitmq.instrumentation import Instrumentation
+    from hmi_rabbitmq.output import write_file
+
+    start = time.perf_counter()
+
+    errors = 0
+    files: List[str] = []
+    items: List[Tuple[Optional[str], str, Mapping[str, Any]]] = []
+    for filename in _expand_files(args.files):
+        try:
+            items.append(load_values_file(filename, args.namespace))
+            files.append(filename)
+        except Exception as e:
+            errors += 1
+            print('{}: {}'.format(filename, repr(e)), file=sys.stderr)
+
+    # files of the same release would overwrite each other's output, render none of them
+    releases: Dict[Tuple[Optional[str], str], List[str]] = {}
+    for filename, item in zip(files, items):
+        releases.setdefault((item[0], item[1]), []).append(filename)
+    duplicates = {release for release, releasefiles in releases.items() if len(releasefiles) > 1}
+    for namespace, releasename in duplicates:
+        for filename in releases[(namespace, releasename)]:
+            errors += 1
+            print('{}: release {}/{} is also in {}'.format(filename, namespace, releasename, ', '.join(
+                f for f in releases[(namespace, releasename)] if f != filename)), file=sys.stderr)
+    if len(duplicates) > 0:
+        files = [f for f, item in zip(files, items) if (item[0], item[1]) not in duplicates]
+        items = [item for item in items if (item[0], item[1]) not in duplicates]
+
+    # starting worker processes costs more than rendering a single release
+    results = generate_batch(items, executor=args.executor if len(items) > 1 else 'serial',
+                             max_workers=args.workers, instrument=args.time)
+
+    os.makedirs(args.output, exist_ok=True)
+    for filename, result in zip(files, results):
+        if result.chart is None:
+            errors += 1
+            print('{}: {}'.format(filename, repr(result.error)), file=sys.stderr)
+            continue
+        outfilename = os.path.join(args.output, '{}{}.{}'.format(
+            '{}-'.format(result.namespace) if result.namespace is not None else '', result.releasename,
+            args.format))
+        write_file(result.chart.data, outfilename, args.format)
+
+    if args.time:
+        for result in sorted(results, key=lambda r: r.duration, reverse=True):
+            print('{:>10.2f} ms  {}/{}'.format(result.duration * 1000, result.namespace, result.releasename),
+                  file=sys.stderr)
+        print('{:>10.2f} ms  total ({} releases, {} errors)'.format(
+            (time.perf_counter() - start) * 1000, len(results), errors), file=sys.stderr)
+        for summary in Instrumentation.aggregate(r.instrumentation for r in results).values():
+            print('{:>10.2f} ms  stage {} (mean {:.2f} ms, max {:.2f} ms)'.format(
+                summary.total * 1000, summary.stage, summary.mean * 1000, summary.max * 1000), file=sys.stderr)
+
+    return 1 if errors > 0 else 0
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='hmi-rabbitmq', description='Helmion Plugin: RabbitMQ')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    render_parser = subparsers.add_parser('render', help='render releases from values files')
+    render_parser.add_argument('files', nargs='+', help='YAML values files, one per release')
+    render_parser.add_argument('-o', '--output', required=True, help='output directory')
+    render_parser.add_argument('-n', '--namespace', default='default',
+                               help='namespace of the releases that do not set one (default: %(default)s)')
+    render_parser.add_argument('-j', '--workers', type=int, default=None,
+                               help='number of parallel workers (default: number of CPUs)')
+    render_parser.add_argument('--executor', choices=['process', 'thread', 'serial'], default='process',
+                               help='how releases are rendered in parallel (default: %(default)s)')
+    render_parser.add_argument('--format', choices=['yaml', 'json', 'ndjson'], default='yaml',
+                               help='output format, the JSON formats are faster to write and can be applied with '
+                                    '"kubectl apply --server-side" (default: %(default)s)')
+    render_parser.add_argument('--time', action='store_true', help='report the render time of each release')
+    render_parser.set_defaults(func=render)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
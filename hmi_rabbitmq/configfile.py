@@ -1,17 +1,192 @@
+import math
 from typing import Optional, Sequence, Mapping, Any, Dict
 
 from kubragen2.configfile import ConfigFile_Extend, ConfigFileExtension, ConfigFileExtensionData, ConfigFileOutput, \
-    ConfigFileOutput_Dict
+    ConfigFileOutput_Dict, ConfigFileRender, ConfigFileRenderMulti
+from kubragen2.exception import InvalidParamError
 from kubragen2.options import Options, optionsmerger
 
+from hmi_rabbitmq.instrumentation import Instrumentation, instrument_stage
+from hmi_rabbitmq.private.cache import LRUCache
+from hmi_rabbitmq.profiles import PERFORMANCE_PROFILES
+from hmi_rabbitmq.quantity import quantity_bytes
+from hmi_rabbitmq.private.chart import extra_claim_mount_path, definitions_path
+from hmi_rabbitmq.private.fingerprint import fingerprint
+from hmi_rabbitmq.private.network import network_config
+
+
+def parse_extra_configuration(value: str) -> Dict[str, str]:
+    """
+    Parses *rabbitmq.conf* lines in the "key = value" format.
+
+    Blank lines and comments are skipped, and values may contain "=".
+
+    :param value: the configuration lines
+    :return: the configuration keys and values
+    :raises InvalidParamError: on a line without "="
+    """
+    ret: Dict[str, str] = {}
+    for line in value.splitlines():
+        line = line.strip()
+        if line == '' or line.startswith('#'):
+            continue
+        key, sep, keyvalue = line.partition('=')
+        if sep == '':
+            raise InvalidParamError('Invalid extraConfiguration line: "{}"'.format(line))
+        ret[key.strip()] = keyvalue.strip()
+    return ret
+
+
+def disk_free_limit(options: Options) -> int:
+    """
+    Returns the free disk space in bytes below which publishers are blocked.
+
+    It is *diskFreeLimit.ratio* of the volume size, and at least the memory limit of the container, so the
+    broker can still page messages out of memory to disk. The volume size is *persistence.size*, unless
+    *diskFreeLimit.volumeSize* is set, which must be done for existing claims.
+
+    The limit must be at most half of the volume, otherwise the disk alarm would block publishers with little or
+    no data stored.
+
+    :param options: the chart options
+    :return: the limit in bytes
+    :raises InvalidParamError: if the volume size is not known, or is too small for the limit
+    """
+    volume_size = options.option_get('diskFreeLimit.volumeSize')
+    if volume_size is None:
+        if not options.option_get('persistence.enabled') or options.option_get('persistence.existingClaim') != '':
+            raise InvalidParamError('diskFreeLimit.volumeSize is required without a persistence volume claim')
+        volume_size = options.option_get('persistence.size')
+    volume_bytes = quantity_bytes(volume_size)
+    ret = math.ceil(volume_bytes * options.option_get('diskFreeLimit.ratio'))
+    memory = options.option_get_opt('resources.limits.memory', None)
+    if memory is not None:
+        ret = max(ret, quantity_bytes(memory))
+    if ret * 2 > volume_bytes:
+        raise InvalidParamError('The disk free limit of {} bytes is too large for a volume of {}, '
+                                'increase the volume size or lower the memory limit'.format(ret, volume_size))
+    return ret
+
 
 class RabbitMQConfigFile(ConfigFile_Extend):
+    """
+    The *rabbitmq.conf* config file.
+
+    Rendered files are cached by a fingerprint of the options listed in :data:`fingerprint_options`, so
+    releases with the same broker configuration render it only once. Subclasses that override :func:`init_value`,
+    :func:`finish_value` or :func:`get_value` are only cached if they also set :data:`fingerprint_options`, which
+    must list every option they read. Config files with extensions are never cached.
+
+    :param merge_config: a config dict merged over the generated one
+    :param extensions: config file extensions
+    :param instrumentation: where to record the config file stages, defaults to the instrumentation of the
+        chart request
+    :param use_cache: whether to use the rendered files cache
+    """
     merge_config: Optional[Mapping[Any, Any]]
+    instrumentation: Optional[Instrumentation]
+    use_cache: bool
+
+    fingerprint_options: Sequence[str] = (
+        'auth.username',
+        'auth.password',
+        'auth.tls',
+        'plugins',
+        'clusterDomain',
+        'service.tlsPort',
+        'service.metricsPort',
+        'loadDefinition',
+        'metrics.enabled',
+        'stream',
+        'metrics.returnPerObjectMetrics',
+        'metrics.disableMetricsCollector',
+        'memoryHighWatermark',
+        'resources.limits.memory',
+        'diskFreeLimit',
+        'persistence.enabled',
+        'persistence.existingClaim',
+        'persistence.size',
+        'persistence.extraClaims',
+        'persistence.walClaim',
+        'extraConfiguration',
+        'performanceProfile',
+        'network',
+        'clustering.enabled',
+        'clustering.addressType',
+    )
+    """the options read by :func:`init_value`"""
+
+    fingerprint_options_clustered: Sequence[str] = (
+        'base.namespace',
+        'base.releasename',
+    )
+    """the options read by :func:`init_value` only when clustering is enabled"""
+
+    render_cache: LRUCache = LRUCache(maxsize=256)
+    """the rendered files cache, shared by all instances"""
 
     def __init__(self, merge_config: Optional[Mapping[Any, Any]] = None,
-                 extensions: Optional[Sequence[ConfigFileExtension]] = None):
+                 extensions: Optional[Sequence[ConfigFileExtension]] = None,
+                 instrumentation: Optional[Instrumentation] = None, use_cache: bool = True):
         super().__init__(extensions)
         self.merge_config = merge_config
+        self.instrumentation = instrumentation
+        self.use_cache = use_cache
+
+    def fingerprint(self, options: Options, renderers: Sequence[ConfigFileRender] = ()) -> Optional[str]:
+        """
+        Returns a stable hash of everything the rendered file depends on, or None if it can't be known.
+        """
+        if len(self.extensions) > 0:
+            return None
+        cls = type(self)
+        if cls.fingerprint_options is RabbitMQConfigFile.fingerprint_options and \
+                any(getattr(cls, method) is not getattr(RabbitMQConfigFile, method)
+                    for method in ('init_value', 'finish_value', 'get_value')):
+            # the options the subclass reads are not known
+            return None
+        names = list(self.fingerprint_options)
+        if options.option_get('clustering.enabled'):
+            # the peer discovery settings depend on the release, unclustered files are shared between releases
+            names.extend(self.fingerprint_options_clustered)
+        try:
+            return fingerprint({
+                'class': '{}.{}'.format(type(self).__module__, type(self).__qualname__),
+                'merge_config': self.merge_config,
+                'options': {name: options.option_get_opt_custom(name, None, []) for name in names},
+                'renderers': list(renderers),
+            })
+        except InvalidParamError:
+            # e.g. a callable in merge_config
+            return None
+
+    def render(self, options: Options, renderers: Sequence[ConfigFileRender]) -> str:
+        """
+        Renders the config file, reusing a previous render with the same fingerprint.
+
+        :param options: the chart options
+        :param renderers: a list of config file renderers to be considered, in order
+        :return: the config file contents
+        """
+        key = self.fingerprint(options, renderers) if self.use_cache else None
+        if key is None:
+            return self._render(options, renderers)
+        return self.render_cache.get_or_create(key, lambda: self._render(options, renderers))
+
+    def _render(self, options: Options, renderers: Sequence[ConfigFileRender]) -> str:
+        value = self.get_value(options)
+        with instrument_stage('configfile.render', self.instrumentation):
+            return ConfigFileRenderMulti(renderers).render(value)
+
+    def get_value(self, options: Options) -> ConfigFileOutput:
+        # if instrumentation is None, the stages are recorded in the instrumentation of the chart request, if any
+        with instrument_stage('configfile.init_value', self.instrumentation):
+            data = self.init_value(options)
+        with instrument_stage('configfile.extensions', self.instrumentation):
+            for extension in self.extensions:
+                extension.process(self, data, options)
+        with instrument_stage('configfile.finish_value', self.instrumentation):
+            return self.finish_value(options, data)
 
     def init_value(self, options: Options) -> ConfigFileExtensionData:
         config: Dict[Any, Any] = {}
@@ -24,6 +199,13 @@ class RabbitMQConfigFile(ConfigFile_Extend):
             config['cluster_formation.node_cleanup.interval'] = 10
             config['cluster_formation.node_cleanup.only_log_warning'] = 'true'
             config['cluster_partition_handling'] = 'autoheal'
+            if options.option_get('clustering.enabled'):
+                service_name = '{}-headless'.format(options.option_get('base.releasename'))
+                config['cluster_formation.k8s.service_name'] = service_name
+                config['cluster_formation.k8s.address_type'] = options.option_get('clustering.addressType')
+                if options.option_get('clustering.addressType') == 'hostname':
+                    config['cluster_formation.k8s.hostname_suffix'] = '.{}.{}.svc.{}'.format(
+                        service_name, options.option_get('base.namespace'), options.option_get('clusterDomain'))
         config['queue_master_locator'] = 'min-masters'
         config['loopback_users.guest'] = 'false'
         if options.option_get('auth.tls.enabled'):
@@ -33,18 +215,59 @@ class RabbitMQConfigFile(ConfigFile_Extend):
             config['ssl_options.cacertfile'] = '/opt/bitnami/rabbitmq/certs/ca_certificate.pem'
             config['ssl_options.certfile'] = '/opt/bitnami/rabbitmq/certs/server_certificate.pem'
             config['ssl_options.keyfile'] = '/opt/bitnami/rabbitmq/certs/server_key.pem'
-        if options.option_get('loadDefinition.enabled') is not None:
-            config['load_definitions'] = '/etc/rabbitmq-load-definition/load_definition.json'
+        if options.option_get('loadDefinition.enabled'):
+            if options.option_get('loadDefinition.skipIfUnchanged'):
+                # only imported when the content hash differs from the last imported one
+                config['definitions.import_backend'] = 'local_filesystem'
+                config['definitions.local.path'] = definitions_path(options)
+                config['definitions.skip_if_unchanged'] = 'true'
+                config['definitions.hashing.algorithm'] = options.option_get('loadDefinition.hashingAlgorithm')
+            else:
+                config['load_definitions'] = definitions_path(options)
         if options.option_get('metrics.enabled'):
             config['prometheus.tcp.port'] = options.option_get('service.metricsPort')
+            if options.option_get('metrics.returnPerObjectMetrics'):
+                config['prometheus.return_per_object_metrics'] = 'true'
+            if options.option_get('metrics.disableMetricsCollector'):
+                # metrics-only deployments don't need the management statistics
+                config['management_agent.disable_metrics_collector'] = 'true'
+        if options.option_get('stream.enabled'):
+            config['stream.listeners.tcp.1'] = options.option_get('stream.port')
+            if options.option_get('stream.advertisedHost') != '':
+                config['stream.advertised_host'] = options.option_get('stream.advertisedHost')
+            config['stream.advertised_port'] = options.option_get_opt('stream.advertisedPort',
+                                                                       options.option_get('stream.port'))
+            config['stream.initial_credits'] = options.option_get('stream.initialCredits')
+            config['stream.credits_required_for_unblocking'] = options.option_get('stream.creditsRequiredForUnblocking')
+            config['stream.frame_max'] = options.option_get('stream.frameMax')
+            config['stream.heartbeat'] = options.option_get('stream.heartbeat')
         if options.option_get('memoryHighWatermark.enabled'):
-            config['total_memory_available_override_value'] = options.option_get_opt('resources.limits.memory', '100Mi')
-            config['vm_memory_high_watermark.{}'.format(
-                options.option_get('memoryHighWatermark.type'))] = options.option_get('memoryHighWatermark.value')
-        if options.option_get('extraConfiguration') != '':
-            for c in options.option_get('extraConfiguration').split('\n'):
-                cv = c.split('=')
-                config[cv[0]] = cv[1]
+            # RabbitMQ doesn't understand Kubernetes units like "Mi", so always use bytes
+            watermark_type = options.option_get('memoryHighWatermark.type')
+            watermark = options.option_get('memoryHighWatermark.value')
+            if watermark_type == 'absolute':
+                watermark = quantity_bytes(watermark)
+            elif watermark_type != 'relative':
+                raise InvalidParamError('Invalid memoryHighWatermark.type: "{}"'.format(watermark_type))
+            config['total_memory_available_override_value'] = quantity_bytes(
+                options.option_get_opt('resources.limits.memory', '100Mi'))
+            config['vm_memory_high_watermark.{}'.format(watermark_type)] = watermark
+            if options.option_get('memoryHighWatermark.pagingRatio') is not None:
+                config['vm_memory_high_watermark_paging_ratio'] = options.option_get('memoryHighWatermark.pagingRatio')
+        wal_claim = options.option_get('persistence.walClaim')
+        if wal_claim != '':
+            if wal_claim not in options.option_get('persistence.extraClaims'):
+                raise InvalidParamError('persistence.walClaim "{}" is not in persistence.extraClaims'.format(wal_claim))
+            config['raft.wal_data_dir'] = extra_claim_mount_path(options, wal_claim)
+        if options.option_get('diskFreeLimit.enabled'):
+            config['disk_free_limit.absolute'] = disk_free_limit(options)
+        profile = options.option_get('performanceProfile')
+        if profile != '':
+            if profile not in PERFORMANCE_PROFILES:
+                raise InvalidParamError('Invalid performanceProfile: "{}"'.format(profile))
+            config.update(PERFORMANCE_PROFILES[profile])
+        config.update(network_config(options))
+        config.update(parse_extra_configuration(options.option_get('extraConfiguration')))
         return ConfigFileExtensionData(config)
 
     def finish_value(self, options: Options, data: ConfigFileExtensionData) -> ConfigFileOutput:
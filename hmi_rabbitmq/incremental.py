@@ -0,0 +1,135 @@
+import json
+import os
+from typing import Optional, Mapping, Any, List, Dict, Iterable, Tuple
+
+from helmion.data import ChartData
+
+from hmi_rabbitmq.chart import RabbitMQChartRequest
+from hmi_rabbitmq.private.fingerprint import fingerprint, resource_key
+
+
+def _release_key(namespace: Optional[str], releasename: str) -> str:
+    return '{}/{}'.format(namespace if namespace is not None else '', releasename)
+
+
+def _resource_stub(data: Mapping[str, Any]) -> ChartData:
+    """
+    Returns only the fields that identify a resource, enough for "kubectl delete -f".
+    """
+    ret: ChartData = {
+        'apiVersion': data['apiVersion'],
+        'kind': data['kind'],
+        'metadata': {
+            'name': data['metadata']['name'],
+        },
+    }
+    if 'namespace' in data['metadata']:
+        ret['metadata']['namespace'] = data['metadata']['namespace']
+    return ret
+
+
+class HashManifest:
+    """
+    The request fingerprints and resource content hashes of a previous run, stored as a JSON file.
+
+    :param releases: the initial manifest data
+    """
+    releases: Dict[str, Any]
+
+    def __init__(self, releases: Optional[Mapping[str, Any]] = None):
+        self.releases = dict(releases) if releases is not None else {}
+
+    @classmethod
+    def load(cls, path: str) -> 'HashManifest':
+        """
+        Loads a manifest file. If the file does not exist, returns an empty manifest.
+        """
+        if not os.path.exists(path):
+            return cls()
+        with open(path, 'r', encoding='utf-8') as fl:
+            return cls(json.load(fl)['releases'])
+
+    def save(self, path: str) -> None:
+        """
+        Saves the manifest file, replacing it atomically.
+        """
+        tmppath = '{}.tmp'.format(path)
+        with open(tmppath, 'w', encoding='utf-8') as fl:
+            json.dump({'releases': self.releases}, fl, sort_keys=True, indent=1)
+        os.replace(tmppath, path)
+
+    def prune(self, keep: Iterable[Tuple[Optional[str], str]]) -> List[ChartData]:
+        """
+        Removes all releases not in *keep* from the manifest.
+
+        :param keep: the (namespace, releasename) of the releases to keep
+        :return: the identifying fields of the resources of the removed releases
+        """
+        keepkeys = {_release_key(namespace, releasename) for namespace, releasename in keep}
+        ret: List[ChartData] = []
+        for releasekey in sorted(set(self.releases.keys()) - keepkeys):
+            ret.extend(r['resource'] for r in self.releases.pop(releasekey)['resources'].values())
+        return ret
+
+
+class IncrementalResult:
+    """
+    The result of :func:`generate_incremental`.
+    """
+    namespace: Optional[str]
+    releasename: str
+    skipped: bool
+    """whether the request was unchanged and was not rendered"""
+    added: List[ChartData]
+    changed: List[ChartData]
+    removed: List[ChartData]
+    """the identifying fields of the removed resources"""
+
+    def __init__(self, namespace: Optional[str], releasename: str, skipped: bool = False):
+        self.namespace = namespace
+        self.releasename = releasename
+        self.skipped = skipped
+        self.added = []
+        self.changed = []
+        self.removed = []
+
+    @property
+    def data(self) -> List[ChartData]:
+        """The resources that must be applied."""
+        return self.added + self.changed
+
+
+def generate_incremental(request: RabbitMQChartRequest, manifest: HashManifest,
+                         force: bool = False) -> IncrementalResult:
+    """
+    Generates only the resources that were added, changed or removed since the run recorded in *manifest*.
+
+    The request is not rendered at all if its fingerprint is unchanged. The manifest is updated in-place.
+
+    :param request: the chart request
+    :param manifest: the previous run manifest
+    :param force: render the request even if its fingerprint is unchanged
+    :return: the changes
+    """
+    releasekey = _release_key(request.namespace, request.releasename)
+    previous = manifest.releases.get(releasekey, {'fingerprint': None, 'resources': {}})
+    request_fingerprint = request.fingerprint()
+    if not force and previous['fingerprint'] == request_fingerprint:
+        return IncrementalResult(request.namespace, request.releasename, skipped=True)
+
+    ret = IncrementalResult(request.namespace, request.releasename)
+    chart = request.generate()
+    resources: Dict[str, Any] = {}
+    for data in chart.data:
+        key, datahash = resource_key(data), fingerprint(data)
+        if key not in previous['resources']:
+            ret.added.append(data)
+        elif previous['resources'][key]['hash'] != datahash:
+            ret.changed.append(data)
+        resources[key] = {'hash': datahash, 'resource': _resource_stub(data)}
+    for key, prevresource in previous['resources'].items():
+        if key not in resources:
+            ret.removed.append(prevresource['resource'])
+
+    manifest.releases[releasekey] = {'fingerprint': request_fingerprint, 'resources': resources}
+    return ret
@@ -0,0 +1,177 @@
+import contextlib
+import contextvars
+import threading
+import time
+import tracemalloc
+from typing import Optional, List, Dict, Callable, Iterable, Iterator, Tuple, ContextManager
+
+
+class StageRecord:
+    """
+    The cost of one stage of one release generation.
+    """
+    release: str
+    """the release, as "namespace/releasename\""""
+    stage: str
+    duration: float
+    """the duration in seconds"""
+    memory: Optional[int]
+    """the traced memory delta in bytes, if memory tracing is enabled. The traced memory is process-wide, so it
+    includes the allocations of other threads running at the same time."""
+
+    def __init__(self, release: str, stage: str, duration: float, memory: Optional[int] = None):
+        self.release = release
+        self.stage = stage
+        self.duration = duration
+        self.memory = memory
+
+
+class StageSummary:
+    """
+    The aggregated cost of a stage over many records.
+    """
+    stage: str
+    count: int
+    total: float
+    min: float
+    max: float
+    memory: Optional[int]
+    """the total traced memory delta in bytes, if memory tracing is enabled"""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.count = 0
+        self.total = 0.0
+        self.min = 0.0
+        self.max = 0.0
+        self.memory = None
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count > 0 else 0.0
+
+    def add(self, record: StageRecord) -> None:
+        self.min = record.duration if self.count == 0 else min(self.min, record.duration)
+        self.max = max(self.max, record.duration)
+        self.count += 1
+        self.total += record.duration
+        if record.memory is not None:
+            self.memory = (self.memory if self.memory is not None else 0) + record.memory
+
+
+_active: 'contextvars.ContextVar[Optional[Tuple[Instrumentation, str]]]' = \
+    contextvars.ContextVar('hmi_rabbitmq_instrumentation', default=None)
+
+
+_tracing_lock = threading.Lock()
+_tracing_stages = 0
+_tracing_started = False
+
+
+def _tracing_enter() -> None:
+    global _tracing_stages, _tracing_started
+    with _tracing_lock:
+        if _tracing_stages == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing_started = True
+        _tracing_stages += 1
+
+
+def _tracing_exit() -> None:
+    global _tracing_stages, _tracing_started
+    with _tracing_lock:
+        _tracing_stages -= 1
+        if _tracing_stages == 0 and _tracing_started:
+            # only stop tracing that was started here, the caller may be tracing too
+            tracemalloc.stop()
+            _tracing_started = False
+
+
+class Instrumentation:
+    """
+    Records the duration, and optionally the traced memory delta, of each stage of chart generation.
+
+    Stages can be nested: the config file stages are recorded while the "resources" stage is running, and
+    their cost is also included in it.
+
+    :param trace_memory: whether to record the traced memory delta of each stage. If :mod:`tracemalloc` is not
+        already tracing, it is started while stages are running and stopped after, as it slows down everything
+        considerably.
+    :param callback: a function called with each :class:`StageRecord` as soon as it is recorded
+    """
+    trace_memory: bool
+    callback: Optional[Callable[[StageRecord], None]]
+    records: List[StageRecord]
+
+    def __init__(self, trace_memory: bool = False, callback: Optional[Callable[[StageRecord], None]] = None):
+        self.trace_memory = trace_memory
+        self.callback = callback
+        self.records = []
+
+    def __getstate__(self):
+        # callbacks are usually not picklable, and only make sense in the process that created them
+        state = self.__dict__.copy()
+        state['callback'] = None
+        return state
+
+    def record(self, record: StageRecord) -> None:
+        self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    @contextlib.contextmanager
+    def stage(self, stage: str, release: str) -> Iterator[None]:
+        """
+        Records the code run inside the context as a stage.
+
+        Config file stages run inside it are recorded in this instance too.
+        """
+        token = _active.set((self, release))
+        memory: Optional[int] = None
+        if self.trace_memory:
+            _tracing_enter()
+            memory = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            if memory is not None:
+                memory = tracemalloc.get_traced_memory()[0] - memory
+                _tracing_exit()
+            _active.reset(token)
+            self.record(StageRecord(release=release, stage=stage, duration=duration, memory=memory))
+
+    def summary(self) -> Dict[str, StageSummary]:
+        """
+        Returns the records aggregated by stage.
+        """
+        return Instrumentation.aggregate([self])
+
+    @staticmethod
+    def aggregate(instrumentations: Iterable[Optional['Instrumentation']]) -> Dict[str, StageSummary]:
+        """
+        Returns the records of many instances aggregated by stage, for example of all releases of a batch.
+        """
+        ret: Dict[str, StageSummary] = {}
+        for instrumentation in instrumentations:
+            if instrumentation is None:
+                continue
+            for record in instrumentation.records:
+                if record.stage not in ret:
+                    ret[record.stage] = StageSummary(record.stage)
+                ret[record.stage].add(record)
+        return ret
+
+
+def instrument_stage(stage: str, instrumentation: Optional[Instrumentation] = None) -> ContextManager[None]:
+    """
+    Records a stage in *instrumentation*, or if None, in the instrumentation of the release being
+    generated, if any.
+    """
+    active = _active.get()
+    if instrumentation is None:
+        if active is None:
+            return contextlib.nullcontext()
+        return active[0].stage(stage, active[1])
+    return instrumentation.stage(stage, active[1] if active is not None else '')
@@ -0,0 +1,132 @@
+import itertools
+import json
+from typing import Any, Dict, Iterable, Iterator, TextIO, Optional, Type, TYPE_CHECKING
+
+import yaml
+from helmion.data import ChartData
+from kubragen2.exception import InvalidParamError
+
+if TYPE_CHECKING:  # pragma: no cover
+    from hmi_rabbitmq.chart import RabbitMQChartRequest
+
+
+OUTPUT_FORMATS = ('yaml', 'json', 'ndjson')
+"""the formats supported by :func:`write_resources`"""
+
+YAML_DUMPER: Type[Any] = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+"""the libyaml C dumper when PyYAML was built with it, else the pure Python one. Both write the same documents,
+but long strings may be folded at different places."""
+
+
+def stream_resources(requests: Iterable['RabbitMQChartRequest']) -> Iterator[ChartData]:
+    """
+    Generates the resources of many requests, one resource at a time.
+
+    *requests* may itself be a generator, so no more than one request and one resource need to be alive at a time.
+
+    :param requests: the chart requests
+    :return: an iterator of built resources
+    """
+    return itertools.chain.from_iterable(request.generate_iter() for request in requests)
+
+
+def write_yaml(resources: Iterable[ChartData], stream: TextIO, dumper: Optional[Type[Any]] = None) -> int:
+    """
+    Writes resources to a stream as a multi-document YAML file, one resource at a time.
+
+    With the default dumper, the output is the same as :class:`kubragen2.output.OutputFile_Kubernetes`.
+
+    :param resources: the resources to write, possibly a generator
+    :param stream: the output text stream
+    :param dumper: the PyYAML dumper class, defaults to :class:`yaml.SafeDumper`. :data:`YAML_DUMPER` is much faster.
+    :return: the number of resources written
+    """
+    yaml_dump_params: Dict[Any, Any] = {'default_flow_style': False, 'sort_keys': False}
+    if dumper is None:
+        dumper = yaml.SafeDumper
+    count = 0
+    for resource in resources:
+        if count > 0:
+            stream.write('---\n')
+        yaml.dump(resource, stream, Dumper=dumper, **yaml_dump_params)
+        count += 1
+    return count
+
+
+def _json_dumps(resource: ChartData) -> str:
+    return json.dumps(resource, separators=(',', ':'), ensure_ascii=False)
+
+
+def write_json(resources: Iterable[ChartData], stream: TextIO) -> int:
+    """
+    Writes resources to a stream as a compact JSON *v1/List*, one resource at a time.
+
+    :param resources: the resources to write, possibly a generator
+    :param stream: the output text stream
+    :return: the number of resources written
+    """
+    stream.write('{"apiVersion":"v1","kind":"List","items":[')
+    count = 0
+    for resource in resources:
+        if count > 0:
+            stream.write(',\n')
+        else:
+            stream.write('\n')
+        stream.write(_json_dumps(resource))
+        count += 1
+    stream.write('\n]}\n')
+    return count
+
+
+def write_ndjson(resources: Iterable[ChartData], stream: TextIO) -> int:
+    """
+    Writes resources to a stream as newline delimited JSON, one compact resource per line.
+
+    :param resources: the resources to write, possibly a generator
+    :param stream: the output text stream
+    :return: the number of resources written
+    """
+    count = 0
+    for resource in resources:
+        stream.write(_json_dumps(resource))
+        stream.write('\n')
+        count += 1
+    return count
+
+
+def write_resources(resources: Iterable[ChartData], stream: TextIO, format: str = 'yaml') -> int:
+    """
+    Writes resources to a stream in one of :data:`OUTPUT_FORMATS`.
+
+    YAML is written with :data:`YAML_DUMPER`. The JSON formats are smaller and faster to write, and can be applied
+    with ``kubectl apply --server-side -f``.
+
+    :param resources: the resources to write, possibly a generator
+    :param stream: the output text stream
+    :param format: "yaml", "json" or "ndjson"
+    :return: the number of resources written
+    :raises InvalidParamError: on an unknown format
+    """
+    if format == 'yaml':
+        return write_yaml(resources, stream, YAML_DUMPER)
+    elif format == 'json':
+        return write_json(resources, stream)
+    elif format == 'ndjson':
+        return write_ndjson(resources, stream)
+    raise InvalidParamError('Invalid output format: "{}"'.format(format))
+
+
+def write_file(resources: Iterable[ChartData], filename: str, format: str = 'yaml') -> int:
+    """
+    Writes resources to a file with :func:`write_resources`, one resource at a time.
+
+    :param resources: the resources to write, possibly a generator
+    :param filename: the output file name
+    :param format: "yaml", "json" or "ndjson"
+    :return: the number of resources written
+    :raises InvalidParamError: on an unknown format
+    """
+    if format not in OUTPUT_FORMATS:
+        raise InvalidParamError('Invalid output format: "{}"'.format(format))
+    with open(filename, 'w', encoding='utf-8') as fl:
+        return write_resources(resources, fl, format)
@@ -0,0 +1,49 @@
+import collections
+import threading
+from typing import Any, Callable, Hashable
+
+
+class LRUCache:
+    """
+    A bounded, thread-safe, least-recently-used cache.
+
+    :param maxsize: the maximum number of entries
+    """
+    maxsize: int
+    hits: int
+    misses: int
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: 'collections.OrderedDict[Hashable, Any]' = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get_or_create(self, key: Hashable, create: Callable[[], Any]) -> Any:
+        """
+        Returns the cached value for *key*, calling *create* to create it if not cached.
+        """
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+        # create outside the lock, concurrent misses of the same key just create it twice
+        value = create()
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
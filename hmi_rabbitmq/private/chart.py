@@ -1,8 +1,12 @@
-from typing import Any, Dict
+from typing import Any, Dict, List, Sequence
 
 from kubragen2.data import Data
+from kubragen2.exception import InvalidParamError
 from kubragen2.options import Options
 
+from hmi_rabbitmq.private import skeleton
+from hmi_rabbitmq.quantity import cpu_cores, parse_quantity
+
 
 class PersistenceData(Data):
     name: str
@@ -63,3 +67,358 @@ class VolumeClaimTemplate(Data):
                 'selector': self.options.option_get('persistence.selector'),
             }
         }
+
+
+def extra_claim_option(options: Options, name: str, field: str, default_value: Any = None) -> Any:
+    """
+    Returns a field of the *persistence.extraClaims.<name>* options.
+    """
+    return options.option_get('persistence.extraClaims.{}'.format(name)).get(field, default_value)
+
+
+def extra_claim_mount_path(options: Options, name: str) -> str:
+    return extra_claim_option(options, name, 'mountPath', '/var/lib/rabbitmq/{}'.format(name))
+
+
+class ExtraVolumeClaimTemplate(Data):
+    """
+    A claim template from the *persistence.extraClaims.<name>* options, for data that should be on a
+    different kind of disk than the message store.
+    """
+    name: str
+    options: Options
+
+    def __init__(self, name: str, options: Options):
+        self.options = options
+        self.name = name
+
+    def is_enabled(self) -> bool:
+        return self.options.option_get('persistence.enabled')
+
+    def get_value(self) -> Any:
+        size = extra_claim_option(self.options, self.name, 'size')
+        if size is None:
+            raise InvalidParamError('persistence.extraClaims.{}.size is required'.format(self.name))
+        ret: Dict[str, Any] = {
+            'metadata': {
+                'name': 'rabbitmq-{}'.format(self.name),
+                'labels': pod_selector_labels(self.options),
+            },
+            'spec': {
+                'accessModes': [
+                    extra_claim_option(self.options, self.name, 'accessMode',
+                                       self.options.option_get('persistence.accessMode')),
+                ],
+                'resources': {
+                    'requests': {
+                        'storage': size,
+                    },
+                },
+            }
+        }
+        # unset uses the default storage class, "-" disables dynamic provisioning
+        storage_class = extra_claim_option(self.options, self.name, 'storageClass')
+        if storage_class not in (None, ''):
+            ret['spec']['storageClassName'] = '' if storage_class == '-' else storage_class
+        selector = extra_claim_option(self.options, self.name, 'selector')
+        if selector:
+            ret['spec']['selector'] = selector
+        return ret
+
+
+class ExtraClaimVolume(Data):
+    """
+    An emptyDir volume in place of an extra claim, when persistence is disabled.
+    """
+    name: str
+    options: Options
+
+    def __init__(self, name: str, options: Options):
+        self.options = options
+        self.name = name
+
+    def is_enabled(self) -> bool:
+        return not self.options.option_get('persistence.enabled')
+
+    def get_value(self) -> Any:
+        return {
+            'name': 'rabbitmq-{}'.format(self.name),
+            'emptyDir': {},
+        }
+
+
+def definition_files(options: Options) -> Dict[str, str]:
+    """
+    The definition files generated by the chart, *loadDefinition.value* as "load_definition.json" and each
+    of *loadDefinition.shards* as "<name>.json".
+    """
+    ret: Dict[str, str] = {}
+    if options.option_get('loadDefinition.value') != '':
+        ret['load_definition.json'] = options.option_get('loadDefinition.value')
+    for name, value in options.option_get('loadDefinition.shards').items():
+        ret['{}.json'.format(name)] = value
+    return ret
+
+
+def definitions_path(options: Options) -> str:
+    """
+    The path the broker imports definitions from, the single definition file or the directory with all of them.
+    """
+    if options.option_get('loadDefinition.source') == 'configMap' and \
+            options.option_get('loadDefinition.existingConfigMap') != '':
+        return '/etc/rabbitmq-load-definition/'
+    if list(definition_files(options).keys()) in ([], ['load_definition.json']):
+        return '/etc/rabbitmq-load-definition/load_definition.json'
+    return '/etc/rabbitmq-load-definition/'
+
+
+def cluster_env(address_type: str, hostname_domain: str) -> List[Any]:
+    """
+    The environment variables that set a node name reachable by the other cluster nodes.
+    """
+    if address_type == 'ip':
+        return [
+            {'name': 'MY_POD_IP', 'valueFrom': {'fieldRef': {'fieldPath': 'status.podIP'}}},
+            {'name': 'RABBITMQ_USE_LONGNAME', 'value': 'true'},
+            {'name': 'RABBITMQ_NODENAME', 'value': 'rabbit@$(MY_POD_IP)'},
+        ]
+    return [
+        {'name': 'MY_POD_NAME', 'valueFrom': {'fieldRef': {'fieldPath': 'metadata.name'}}},
+        {'name': 'RABBITMQ_USE_LONGNAME', 'value': 'true'},
+        {'name': 'RABBITMQ_NODENAME', 'value': 'rabbit@$(MY_POD_NAME).{}'.format(hostname_domain)},
+    ]
+
+
+def erlang_args(options: Options) -> str:
+    """
+    The Erlang VM flags for *RABBITMQ_SERVER_ADDITIONAL_ERL_ARGS*.
+
+    Options that are None are derived from the container CPU limit when there is one, otherwise the image
+    defaults are kept.
+    """
+    schedulers = options.option_get('erlang.schedulers')
+    cpu = options.option_get_opt('resources.limits.cpu', None)
+    if schedulers is None and cpu is not None:
+        # one scheduler per core the container may use, instead of one per host core
+        schedulers = cpu_cores(cpu)
+    if schedulers is not None and (not isinstance(schedulers, int) or schedulers < 1):
+        raise InvalidParamError('Invalid erlang.schedulers: "{}"'.format(schedulers))
+
+    busy_wait = options.option_get('erlang.schedulerBusyWait')
+    async_threads = options.option_get('erlang.asyncThreads')
+    if schedulers is not None:
+        if busy_wait is None:
+            # busy waiting burns the CPU quota, and gets the container throttled
+            busy_wait = 'none'
+        if async_threads is None:
+            async_threads = min(128, max(16, 16 * schedulers))
+
+    args: List[str] = []
+    if schedulers is not None:
+        args.append('+S {0}:{0}'.format(schedulers))
+    if busy_wait is not None:
+        args.extend(['+sbwt {}'.format(busy_wait), '+sbwtdcpu {}'.format(busy_wait),
+                     '+sbwtdio {}'.format(busy_wait)])
+    if async_threads is not None:
+        args.append('+A {}'.format(async_threads))
+    if options.option_get('erlang.processLimit') is not None:
+        args.append('+P {}'.format(options.option_get('erlang.processLimit')))
+    if options.option_get('erlang.distributionBufferSize') is not None:
+        args.append('+zdbbl {}'.format(options.option_get('erlang.distributionBufferSize')))
+    if options.option_get('erlang.extraArgs') != '':
+        args.append(options.option_get('erlang.extraArgs'))
+    return ' '.join(args)
+
+
+def guaranteed_resources(options: Options) -> Dict[str, Any]:
+    """
+    The container resources with requests equal to limits, so the pod gets the Guaranteed QoS class.
+
+    The CPU limit must be a whole number of cores, so the kubelet static CPU manager can give the broker
+    exclusive cores.
+
+    :raises InvalidParamError: if the limits are not usable
+    """
+    limits = options.option_get_opt('resources.limits', None)
+    if limits is None or limits.get('cpu') is None or limits.get('memory') is None:
+        raise InvalidParamError('placement.guaranteedQoS requires resources.limits.cpu and resources.limits.memory')
+    cpu = parse_quantity(limits['cpu'])
+    if cpu <= 0 or cpu != cpu.to_integral_value():
+        raise InvalidParamError('placement.guaranteedQoS requires an integer resources.limits.cpu, got "{}"'.format(
+            limits['cpu']))
+    ret = dict(options.option_get('resources'))
+    ret['requests'] = dict(limits)
+    return ret
+
+
+def pre_stop_command(options: Options) -> List[str]:
+    """
+    The preStop command of the upgrade mode, which waits until stopping the node doesn't make quorum queues and
+    mirrored queues unavailable, and then moves its clients and queue leaders to the other nodes.
+    """
+    timeout = options.option_get('upgrade.terminationGracePeriodSeconds')
+    commands: List[str] = []
+    if options.option_get('clustering.enabled'):
+        # an unclustered node can't have its queues replicated elsewhere, it would wait until the timeout.
+        # Not keyed on the replica count, so scaling doesn't change the pod template.
+        if options.option_get('upgrade.awaitQuorumPlusOne'):
+            commands.append('rabbitmq-upgrade await_online_quorum_plus_one -t {}'.format(timeout))
+        if options.option_get('upgrade.awaitSynchronizedMirror'):
+            commands.append('rabbitmq-upgrade await_online_synchronized_mirror -t {}'.format(timeout))
+    await_commands = ' && '.join(commands)
+    drain = 'rabbitmq-upgrade drain -t {}'.format(timeout)
+    return ['/bin/sh', '-c', '{}; {}'.format(await_commands, drain) if await_commands != '' else drain]
+
+
+def pod_selector_labels(options: Options) -> Dict[str, Any]:
+    return {
+        'app.kubernetes.io/name': 'rabbitmq',
+        'app.kubernetes.io/instance': options.option_get('base.releasename'),
+    }
+
+
+class PodAntiAffinityData(Data):
+    options: Options
+
+    def __init__(self, options: Options):
+        self.options = options
+
+    def is_enabled(self) -> bool:
+        return self.options.option_get('clustering.enabled') and \
+               self.options.option_get('clustering.podAntiAffinity') in ('soft', 'hard')
+
+    def get_value(self) -> Any:
+        term = {
+            'labelSelector': {
+                'matchLabels': pod_selector_labels(self.options),
+            },
+            'topologyKey': 'kubernetes.io/hostname',
+        }
+        if self.options.option_get('clustering.podAntiAffinity') == 'hard':
+            return {
+                'podAntiAffinity': {
+                    'requiredDuringSchedulingIgnoredDuringExecution': [term],
+                },
+            }
+        return {
+            'podAntiAffinity': {
+                'preferredDuringSchedulingIgnoredDuringExecution': [{
+                    'weight': 100,
+                    'podAffinityTerm': term,
+                }],
+            },
+        }
+
+
+class TopologySpreadData(Data):
+    options: Options
+
+    def __init__(self, options: Options):
+        self.options = options
+
+    def is_enabled(self) -> bool:
+        return self.options.option_get('clustering.enabled') and \
+               self.options.option_get('clustering.topologySpread.enabled') and \
+               any(key != '' for key in self.options.option_get('clustering.topologySpread.topologyKeys').values())
+
+    def get_value(self) -> Any:
+        return [{
+            'maxSkew': self.options.option_get('clustering.topologySpread.maxSkew'),
+            'topologyKey': key,
+            'whenUnsatisfiable': self.options.option_get('clustering.topologySpread.whenUnsatisfiable'),
+            'labelSelector': {
+                'matchLabels': pod_selector_labels(self.options),
+            },
+        } for key in self.options.option_get('clustering.topologySpread.topologyKeys').values() if key != '']
+
+
+class ProbeData(Data):
+    """
+    A container probe from the *name* option group.
+
+    :param name: the probe option group, like "livenessProbe"
+    :param options: the chart options
+    :param command: the command of the "exec" mode
+    :param default_initial_delay: the *initialDelaySeconds* used when the option is None
+    """
+    name: str
+    options: Options
+    command: Sequence[str]
+    default_initial_delay: int
+
+    def __init__(self, name: str, options: Options, command: Sequence[str], default_initial_delay: int = 0):
+        self.name = name
+        self.options = options
+        self.command = command
+        self.default_initial_delay = default_initial_delay
+
+    def is_enabled(self) -> bool:
+        return self.options.option_get('{}.enabled'.format(self.name))
+
+    def get_value(self) -> Any:
+        mode = self.options.option_get('{}.mode'.format(self.name))
+        ret: Dict[str, Any]
+        # fresh lists, another probe of the container may use the same shared command
+        if mode == 'exec':
+            ret = {'exec': {'command': list(self.command)}}
+        elif mode == 'diagnostics':
+            ret = {'exec': {'command': list(skeleton.port_connectivity_command())}}
+        elif mode == 'tcp':
+            ret = {'tcpSocket': {'port': self.options.option_get('{}.tcpPort'.format(self.name))}}
+        elif mode == 'http':
+            ret = {'httpGet': {
+                'path': self.options.option_get('{}.httpPath'.format(self.name)),
+                'port': self.options.option_get('{}.httpPort'.format(self.name)),
+            }}
+        else:
+            raise InvalidParamError('Invalid {}.mode: "{}"'.format(self.name, mode))
+        for field in ('initialDelaySeconds', 'periodSeconds', 'timeoutSeconds', 'failureThreshold',
+                      'successThreshold'):
+            ret[field] = self.options.option_get('{}.{}'.format(self.name, field))
+        if ret['initialDelaySeconds'] is None:
+            ret['initialDelaySeconds'] = self.default_initial_delay
+        return ret
+
+
+class DetailedMetricsEndpoint(Data):
+    """
+    A ServiceMonitor endpoint that scrapes metric families from the detailed prometheus endpoint, from
+    the *metrics.serviceMonitor.detailed.<name>* options.
+
+    :param name: the endpoint name
+    :param options: the chart options
+    """
+    name: str
+    options: Options
+
+    def __init__(self, name: str, options: Options):
+        self.name = name
+        self.options = options
+
+    def _option(self, name: str, default_value: Any) -> Any:
+        return self.options.option_get('metrics.serviceMonitor.detailed.{}'.format(self.name)).get(
+            name, default_value)
+
+    def is_enabled(self) -> bool:
+        return self._option('enabled', True)
+
+    def get_value(self) -> Any:
+        families = self._option('families', [])
+        if len(families) == 0:
+            raise InvalidParamError('metrics.serviceMonitor.detailed.{}.families is required'.format(self.name))
+        params: Dict[str, Any] = {
+            'family': list(families),
+        }
+        vhosts = self._option('vhosts', [])
+        if len(vhosts) > 0:
+            params['vhost'] = list(vhosts)
+        ret: Dict[str, Any] = {
+            'port': 'metrics',
+            'path': '/metrics/detailed',
+            'params': params,
+            'interval': self._option('interval', self.options.option_get('metrics.serviceMonitor.interval')),
+        }
+        relabelings = self._option('metricRelabelings', [])
+        if len(relabelings) > 0:
+            ret['metricRelabelings'] = relabelings
+        return ret
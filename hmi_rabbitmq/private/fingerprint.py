@@ -0,0 +1,53 @@
+import hashlib
+import json
+from typing import Any
+
+from helmion.data import ChartData
+from kubragen2.data import Data
+from kubragen2.exception import InvalidParamError
+
+from hmi_rabbitmq.instrumentation import Instrumentation
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, Instrumentation):
+        # measurements don't change the output
+        return None
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=repr)
+    if isinstance(value, Data):
+        return {
+            '__data__': '{}.{}'.format(type(value).__module__, type(value).__qualname__),
+            'value': value.get_value() if value.is_enabled() else None,
+        }
+    if isinstance(value, type):
+        return {'__type__': '{}.{}'.format(value.__module__, value.__qualname__)}
+    if not callable(value) and hasattr(value, '__dict__'):
+        return {
+            '__class__': '{}.{}'.format(type(value).__module__, type(value).__qualname__),
+            'state': vars(value),
+        }
+    # functions have no comparable state, and repr may contain memory addresses
+    raise TypeError('Value of type "{}" can\'t be fingerprinted'.format(type(value).__qualname__))
+
+
+def fingerprint(value: Any) -> str:
+    """
+    Returns a stable hash of a value, independent of dict ordering and object identity.
+
+    :raises InvalidParamError: if the value contains callables or objects without comparable state
+    """
+    try:
+        data = json.dumps(value, sort_keys=True, separators=(',', ':'), default=_json_default)
+    except (TypeError, ValueError) as e:
+        raise InvalidParamError(str(e)) from e
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def resource_key(data: ChartData) -> str:
+    """
+    Returns a key that identifies a Kubernetes resource.
+    """
+    metadata = data.get('metadata', {})
+    return '{}/{}/{}/{}'.format(data.get('apiVersion', ''), data.get('kind', ''),
+                                metadata.get('namespace', ''), metadata.get('name', ''))
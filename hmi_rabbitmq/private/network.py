@@ -0,0 +1,89 @@
+import re
+from typing import Any, Dict, List
+
+from kubragen2.exception import InvalidParamError
+from kubragen2.options import Options
+
+from hmi_rabbitmq.profiles import NETWORK_PROFILES
+
+
+# sysctls in these namespaces are per pod, the others would change the node
+_SYSCTL_NAMESPACED_RE = re.compile(r'^(net\.[a-z0-9_.\-/]+|kernel\.shm[a-z_]+|kernel\.msg[a-z_]+|kernel\.sem|'
+                                   r'fs\.mqueue\.[a-z_]+)$')
+
+
+def _positive_int(name: str, value: Any, minimum: int = 1) -> int:
+    if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+        raise InvalidParamError('Invalid network.{}: "{}"'.format(name, value))
+    return value
+
+
+def _sysctl_int(name: str, value: Any) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise InvalidParamError('Invalid value of sysctl "{}": "{}"'.format(name, value)) from None
+
+
+def network_settings(options: Options) -> Dict[str, Any]:
+    """
+    The *network* options that are set, over the defaults of the performance profile.
+    """
+    ret: Dict[str, Any] = dict(NETWORK_PROFILES.get(options.option_get('performanceProfile'), {}))
+    for name in ('backlog', 'sndbuf', 'recbuf', 'nodelay', 'heartbeat'):
+        if options.option_get('network.{}'.format(name)) is not None:
+            ret[name] = options.option_get('network.{}'.format(name))
+    for name in ('tcp', 'ssl'):
+        if options.option_get('network.acceptors.{}'.format(name)) is not None:
+            ret['acceptors.{}'.format(name)] = options.option_get('network.acceptors.{}'.format(name))
+    return ret
+
+
+def network_config(options: Options) -> Dict[str, Any]:
+    """
+    The *rabbitmq.conf* settings of the *network* options.
+
+    :raises InvalidParamError: on invalid values
+    """
+    settings = network_settings(options)
+    ret: Dict[str, Any] = {}
+    if 'backlog' in settings:
+        ret['tcp_listen_options.backlog'] = _positive_int('backlog', settings['backlog'])
+        somaxconn = options.option_get('network.sysctls').get('net.core.somaxconn')
+        if somaxconn is not None and _sysctl_int('net.core.somaxconn', somaxconn) < settings['backlog']:
+            # the kernel silently caps the backlog
+            raise InvalidParamError('network.backlog {} is larger than the net.core.somaxconn sysctl {}'.format(
+                settings['backlog'], somaxconn))
+    if 'nodelay' in settings:
+        if not isinstance(settings['nodelay'], bool):
+            raise InvalidParamError('Invalid network.nodelay: "{}"'.format(settings['nodelay']))
+        ret['tcp_listen_options.nodelay'] = 'true' if settings['nodelay'] else 'false'
+    for name in ('sndbuf', 'recbuf'):
+        if name in settings:
+            ret['tcp_listen_options.{}'.format(name)] = _positive_int(name, settings[name], 1024)
+    for name in ('tcp', 'ssl'):
+        if 'acceptors.{}'.format(name) in settings:
+            ret['num_acceptors.{}'.format(name)] = _positive_int('acceptors.{}'.format(name),
+                                                                 settings['acceptors.{}'.format(name)])
+    if 'heartbeat' in settings:
+        # 0 disables heartbeats
+        ret['heartbeat'] = _positive_int('heartbeat', settings['heartbeat'], 0)
+    return ret
+
+
+def pod_sysctls(options: Options) -> List[Any]:
+    """
+    The pod *securityContext.sysctls* of the *network.sysctls* options.
+
+    Sysctls outside the Kubernetes safe set must be allowed in the kubelet with *--allowed-unsafe-sysctls*.
+
+    :raises InvalidParamError: on sysctls that can't be set per pod
+    """
+    ret: List[Any] = []
+    for name, value in options.option_get('network.sysctls').items():
+        if _SYSCTL_NAMESPACED_RE.match(name) is None:
+            raise InvalidParamError('Sysctl "{}" can\'t be set per pod'.format(name))
+        if value is None or str(value) == '':
+            raise InvalidParamError('Invalid value of sysctl "{}"'.format(name))
+        ret.append({'name': name, 'value': str(value)})
+    return ret
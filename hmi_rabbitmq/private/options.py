@@ -0,0 +1,131 @@
+import copy
+from typing import Any, Dict, Mapping, Sequence, List, Tuple
+
+from kubragen2.exception import InvalidParamError
+from kubragen2.option import Option, OptionValue
+from kubragen2.options import Options
+
+
+class OptionsChanges:
+    """
+    The dotted names changed by :func:`options_derive`.
+    """
+    copied: List[Tuple[str, Any]]
+    """containers that were copied to be changed, and their new value. Their children are unchanged unless
+    listed too."""
+    replaced: List[Tuple[str, Any]]
+    """values that were replaced as a whole, and their new value"""
+
+    def __init__(self):
+        self.copied = []
+        self.replaced = []
+
+
+def options_derive(base: Mapping[Any, Any], override: Mapping[Any, Any], changes: OptionsChanges,
+                   prefix: str = '') -> Dict[Any, Any]:
+    """
+    Merges *override* over *base* with the same rules as :data:`kubragen2.options.optionsmerger`, without
+    changing *base*. Only the containers in the path of an overridden value are copied, all other values are
+    shared with *base*.
+
+    :param base: the base options
+    :param override: the options to merge over *base*
+    :param changes: receives the changed dotted names
+    :param prefix: the dotted name prefix of *base*
+    :return: the merged options
+    """
+    ret = dict(base)
+    for key, value in override.items():
+        name = '{}{}'.format(prefix, key)
+        current = base.get(key)
+        if isinstance(current, Mapping) and isinstance(value, Mapping):
+            ret[key] = options_derive(current, value, changes, name + '.')
+            changes.copied.append((name, ret[key]))
+        elif isinstance(current, list) and isinstance(value, list):
+            ret[key] = current + value
+            changes.replaced.append((name, ret[key]))
+        else:
+            ret[key] = value
+            changes.replaced.append((name, ret[key]))
+    return ret
+
+
+class ResolvedOptions(Options):
+    """
+    A read-only snapshot of :class:`Options`, with every dotted name resolved once at creation.
+
+    Lookups are a single dict access instead of a dotted-path walk, and :class:`Option` values are
+    processed only once. The merged options are shared with the source, and must not be changed afterwards.
+
+    :param options: the options to take the snapshot from
+    """
+    _values: Dict[str, Any]
+    _raw_options: Dict[str, Option]
+
+    def __init__(self, options: Options):
+        self.options = options.options
+        self._values = {}
+        self._raw_options = {}
+        self._flatten(self.options, '')
+        self._resolve()
+
+    def derive(self, options: Mapping[Any, Any], changes: OptionsChanges) -> 'ResolvedOptions':
+        """
+        Returns a snapshot of options derived from the ones of this snapshot by :func:`options_derive`.
+        Only the changed names are flattened again.
+        """
+        ret = copy.copy(self)
+        ret.options = options
+        ret._values = dict(self._values)
+        ret._raw_options = dict(self._raw_options)
+        for name, value in changes.replaced:
+            prefix = name + '.'
+            for oldname in [n for n in ret._values.keys() if n.startswith(prefix)]:
+                del ret._values[oldname]
+                ret._raw_options.pop(oldname, None)
+            ret._raw_options.pop(name, None)
+            ret._set(name, value)
+            if isinstance(value, Mapping):
+                ret._flatten(value, prefix)
+        for name, value in changes.copied:
+            ret._values[name] = value
+        ret._resolve()
+        return ret
+
+    def _set(self, name: str, value: Any) -> None:
+        self._values[name] = value
+        if isinstance(value, Option):
+            self._raw_options[name] = value
+
+    def _flatten(self, data: Mapping[Any, Any], prefix: str) -> None:
+        for key, value in data.items():
+            name = '{}{}'.format(prefix, key)
+            self._set(name, value)
+            if isinstance(value, Mapping):
+                self._flatten(value, name + '.')
+
+    def _resolve(self) -> None:
+        # options may reference other options, resolve all from their raw values
+        self._values.update(self._raw_options)
+        self._values.update({name: self._option_process(value) for name, value in self._raw_options.items()})
+
+    def has_option(self, name: str) -> Any:
+        return name in self._values
+
+    def option_get(self, name: str) -> Any:
+        try:
+            return self._values[name]
+        except KeyError:
+            raise InvalidParamError('Could not find item "{}"'.format(name)) from None
+
+    def option_get_opt_custom(self, name: str, default_value: Any, empty_values: Sequence[Any]) -> Any:
+        value = self._values.get(name, default_value)
+        if value in empty_values:
+            return default_value
+        return value
+
+    def _option_process(self, value: Any) -> Any:
+        if isinstance(value, OptionValue):
+            # the source value may not be resolved yet while the snapshot is being built
+            return value.process_value(self._option_process(self.option_get(value.name)))
+        return super()._option_process(value)
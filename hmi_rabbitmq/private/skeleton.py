@@ -0,0 +1,241 @@
+"""
+Static manifest sub-trees that are identical for every release.
+
+Each function returns the same instance on every call, so generated charts share these sub-trees instead of
+allocating them per release. They must be treated as read-only.
+"""
+import functools
+from typing import Any, Dict, List, Mapping, Optional
+
+
+@functools.lru_cache(maxsize=None)
+def rbac_rules() -> List[Any]:
+    return [{'apiGroups': [''], 'resources': ['endpoints'], 'verbs': ['get']},
+            {'apiGroups': [''], 'resources': ['events'], 'verbs': ['create']}]
+
+
+@functools.lru_cache(maxsize=None)
+def headless_ports(stream_port: Optional[int]) -> List[Any]:
+    ret: List[Any] = [{
+        'name': 'epmd',
+        'port': 4369,
+        'protocol': 'TCP',
+        'targetPort': 4369
+    },
+    {
+        'name': 'cluster-links',
+        'port': 25672,
+        'protocol': 'TCP',
+        'targetPort': 25672
+    }]
+    if stream_port is not None:
+        ret.append({
+            'name': 'stream',
+            'port': stream_port,
+            'protocol': 'TCP',
+            'targetPort': 'stream'
+        })
+    return ret
+
+
+@functools.lru_cache(maxsize=None)
+def init_security_context() -> Mapping[str, Any]:
+    return {
+        'runAsUser': 0,
+        'runAsGroup': 0
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def init_volume_mounts() -> List[Any]:
+    return [{
+        'name': 'rabbitmq-config',
+        'mountPath': '/tmp/rabbitmq'
+    },
+    {
+        'name': 'rabbitmq-config-rw',
+        'mountPath': '/etc/rabbitmq'
+    },
+    {
+        'name': 'rabbitmq-config-erlang-cookie',
+        'mountPath': '/tmp/rabbitmq-cookie'
+    }]
+
+
+@functools.lru_cache(maxsize=None)
+def init_command(advanced_config: bool, stream_advertised_host: bool) -> List[str]:
+    return ['sh',
+            '-c',
+            ('cp '
+             '/tmp/rabbitmq/advanced.config '
+             '/etc/rabbitmq/advanced.config; '
+             'chown '
+             '999.999 '
+             '/etc/rabbitmq/advanced.config; ' if advanced_config else '') +
+            'cp '
+            '/tmp/rabbitmq/rabbitmq.conf '
+            '/etc/rabbitmq/rabbitmq.conf '
+            "&& echo '' "
+            '>> '
+            '/etc/rabbitmq/rabbitmq.conf; ' +
+            # each pod advertises its own stream host, the config file is shared by all pods
+            ('echo '
+             '"stream.advertised_host = $(hostname)${STREAM_ADVERTISED_HOST_SUFFIX}" '
+             '>> '
+             '/etc/rabbitmq/rabbitmq.conf; ' if stream_advertised_host else '') +
+            'cp '
+            '/tmp/rabbitmq/enabled_plugins '
+            '/etc/rabbitmq/enabled_plugins; '
+            'mkdir -p '
+            '/var/lib/rabbitmq; '
+            'cp '
+            '/tmp/rabbitmq-cookie/rabbitmq-erlang-cookie '
+            '/var/lib/rabbitmq/.erlang.cookie; '
+            'chmod 600 '
+            '/var/lib/rabbitmq/.erlang.cookie; '
+            'chown '
+            '999.999 '
+            '/etc/rabbitmq/rabbitmq.conf '
+            '/etc/rabbitmq/enabled_plugins '
+            '/var/lib/rabbitmq '
+            '/var/lib/rabbitmq/.erlang.cookie']
+
+
+@functools.lru_cache(maxsize=None)
+def config_items(advanced_config: bool) -> List[Any]:
+    ret: List[Any] = [{
+        'key': 'enabled_plugins',
+        'path': 'enabled_plugins'
+    },
+    {
+        'key': 'rabbitmq.conf',
+        'path': 'rabbitmq.conf'
+    }]
+    if advanced_config:
+        ret.append({
+            'key': 'advanced.config',
+            'path': 'advanced.config'
+        })
+    return ret
+
+
+@functools.lru_cache(maxsize=None)
+def config_rw_volume() -> Mapping[str, Any]:
+    return {
+        'name': 'rabbitmq-config-rw',
+        'emptyDir': {}
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def erlang_cookie_items() -> List[Any]:
+    return [{
+        'key': 'rabbitmq-erlang-cookie',
+        'path': 'rabbitmq-erlang-cookie',
+    }]
+
+
+@functools.lru_cache(maxsize=None)
+def load_definition_items() -> List[Any]:
+    return [{
+        'key': 'load_definition.json',
+        'path': 'load_definition.json',
+    }]
+
+
+@functools.lru_cache(maxsize=None)
+def pod_security_context(fs_group_change_policy: str) -> Mapping[str, Any]:
+    ret: Dict[str, Any] = {
+        'fsGroup': 999,
+        'runAsUser': 999,
+        'runAsGroup': 999
+    }
+    if fs_group_change_policy != '':
+        ret['fsGroupChangePolicy'] = fs_group_change_policy
+    return ret
+
+
+@functools.lru_cache(maxsize=None)
+def container_volume_mounts() -> List[Any]:
+    return [{
+        'name': 'rabbitmq-config-rw',
+        'mountPath': '/etc/rabbitmq'
+    },
+    {
+        'name': 'rabbitmq-data',
+        'mountPath': '/var/lib/rabbitmq/mnesia'
+    }, {
+        'name': 'rabbitmq-config-load-definition',
+        'mountPath': '/etc/rabbitmq-load-definition',
+        'readOnly': True,
+    }]
+
+
+@functools.lru_cache(maxsize=None)
+def container_ports(tls_enabled: bool, stream_port: Optional[int]) -> List[Any]:
+    ret: List[Any] = [{
+        'name': 'amqp',
+        'containerPort': 5672,
+        'protocol': 'TCP'
+    }]
+    if tls_enabled:
+        ret.append({
+            'name': 'amqp-ssl',
+            'containerPort': 5671,
+            'protocol': 'TCP'
+        })
+    ret.extend([{
+        'name': 'http-stats',
+        'containerPort': 15672,
+        'protocol': 'TCP'
+    },
+    {
+        'name': 'metrics',
+        'containerPort': 15692,
+        'protocol': 'TCP'
+    },
+    {
+        'name': 'epmd',
+        'containerPort': 4369,
+        'protocol': 'TCP'
+    }])
+    if stream_port is not None:
+        ret.append({
+            'name': 'stream',
+            'containerPort': stream_port,
+            'protocol': 'TCP'
+        })
+    return ret
+
+
+@functools.lru_cache(maxsize=None)
+def liveness_command() -> List[str]:
+    return ['rabbitmq-diagnostics', 'status']
+
+
+@functools.lru_cache(maxsize=None)
+def readiness_command() -> List[str]:
+    return ['rabbitmq-diagnostics', 'ping']
+
+
+@functools.lru_cache(maxsize=None)
+def port_connectivity_command() -> List[str]:
+    return ['rabbitmq-diagnostics', '-q', 'check_port_connectivity']
+
+
+@functools.lru_cache(maxsize=None)
+def projected_config_env(advanced_config: bool) -> List[Any]:
+    ret: List[Any] = [{
+        'name': 'RABBITMQ_CONFIG_FILE',
+        'value': '/etc/rabbitmq-config/rabbitmq.conf'
+    },
+    {
+        'name': 'RABBITMQ_ENABLED_PLUGINS_FILE',
+        'value': '/etc/rabbitmq-config/enabled_plugins'
+    }]
+    if advanced_config:
+        ret.append({
+            'name': 'RABBITMQ_ADVANCED_CONFIG_FILE',
+            'value': '/etc/rabbitmq-config/advanced.config'
+        })
+    return ret
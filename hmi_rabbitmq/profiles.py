@@ -0,0 +1,60 @@
+"""
+Curated *rabbitmq.conf* settings for the ``performanceProfile`` option.
+
+The ``network`` option group defaults of each profile are in :data:`NETWORK_PROFILES`.
+
+Every key can be overridden through ``merge_config`` of :class:`hmi_rabbitmq.RabbitMQConfigFile` or through
+``extraConfiguration``.
+"""
+from typing import Any, Mapping
+
+PERFORMANCE_PROFILES: Mapping[str, Mapping[str, Any]] = {
+    # Many publishers and consumers moving a lot of data over few connections.
+    'throughput': {
+        # emit management statistics less often, they compete with message delivery for CPU
+        'collect_statistics_interval': 30000,
+        # quorum queues: fewer, larger segment files and bigger WAL batches
+        'raft.segment_max_entries': 32768,
+        'raft.wal_max_batch_size': 32768,
+    },
+    # Small messages that must be delivered as soon as possible.
+    'low-latency': {
+        'collect_statistics_interval': 10000,
+        # small WAL batches are flushed sooner
+        'raft.wal_max_batch_size': 1024,
+    },
+    # Many mostly idle connections, or brokers with small memory limits.
+    'low-memory': {
+        'collect_statistics_interval': 60000,
+        # channels are a per connection memory cost
+        'channel_max': 128,
+        # keep only small messages in the queue index, larger ones go to the message store
+        'queue_index_embed_msgs_below': 1024,
+        # quorum queues: a smaller WAL is flushed to segments sooner, releasing its memory
+        'raft.wal_max_size_bytes': 67108864,
+        'raft.segment_max_entries': 2048,
+    },
+}
+"""the settings of each performance profile"""
+
+NETWORK_PROFILES: Mapping[str, Mapping[str, Any]] = {
+    'throughput': {
+        # accept connection bursts without dropping SYNs, also limited by the net.core.somaxconn sysctl
+        'backlog': 4096,
+        'nodelay': True,
+        # larger socket buffers, about 192 KiB per connection
+        'sndbuf': 196608,
+        'recbuf': 196608,
+    },
+    'low-latency': {
+        # don't wait to coalesce small frames (Nagle's algorithm)
+        'nodelay': True,
+        'backlog': 1024,
+    },
+    'low-memory': {
+        # about 32 KiB per socket buffer instead of the OS default
+        'sndbuf': 32768,
+        'recbuf': 32768,
+    },
+}
+"""the ``network`` option group defaults of each performance profile"""
@@ -0,0 +1,76 @@
+"""
+Kubernetes resource quantities, like "500m", "2" or "1Gi".
+"""
+import math
+import re
+from decimal import Decimal, InvalidOperation
+from typing import Union
+
+from kubragen2.exception import InvalidParamError
+
+
+_QUANTITY_RE = re.compile(r'^([+-]?(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+)(?:[eE][+-]?[0-9]+)?)(Ki|Mi|Gi|Ti|Pi|Ei|n|u|m|k|M|G|T|P|E)?$')
+
+_SUFFIXES = {
+    None: Decimal(1),
+    'n': Decimal('1e-9'),
+    'u': Decimal('1e-6'),
+    'm': Decimal('1e-3'),
+    'k': Decimal(10) ** 3,
+    'M': Decimal(10) ** 6,
+    'G': Decimal(10) ** 9,
+    'T': Decimal(10) ** 12,
+    'P': Decimal(10) ** 15,
+    'E': Decimal(10) ** 18,
+    'Ki': Decimal(2) ** 10,
+    'Mi': Decimal(2) ** 20,
+    'Gi': Decimal(2) ** 30,
+    'Ti': Decimal(2) ** 40,
+    'Pi': Decimal(2) ** 50,
+    'Ei': Decimal(2) ** 60,
+}
+
+QuantityType = Union[str, int, float, Decimal]
+
+
+def parse_quantity(value: QuantityType) -> Decimal:
+    """
+    Parses a Kubernetes quantity into its exact value.
+
+    :param value: the quantity, numbers are taken as they are
+    :return: the quantity value
+    :raises InvalidParamError: if the quantity is invalid
+    """
+    if isinstance(value, bool):
+        raise InvalidParamError('Invalid quantity: "{}"'.format(value))
+    if isinstance(value, (int, Decimal)):
+        return Decimal(value)
+    if isinstance(value, float):
+        return Decimal(str(value))
+    match = _QUANTITY_RE.match(str(value).strip())
+    if match is None:
+        raise InvalidParamError('Invalid quantity: "{}"'.format(value))
+    try:
+        return Decimal(match.group(1)) * _SUFFIXES[match.group(2)]
+    except InvalidOperation:
+        raise InvalidParamError('Invalid quantity: "{}"'.format(value)) from None
+
+
+def cpu_cores(value: QuantityType) -> int:
+    """
+    Returns the number of whole cores needed to run a CPU quantity, at least 1.
+
+    :param value: the CPU quantity, like "500m" or 2
+    :return: the number of cores
+    """
+    return max(1, math.ceil(parse_quantity(value)))
+
+
+def quantity_bytes(value: QuantityType) -> int:
+    """
+    Returns a memory or storage quantity in bytes, rounded up like Kubernetes does.
+
+    :param value: the quantity, like "512Mi" or "8Gi"
+    :return: the number of bytes
+    """
+    return math.ceil(parse_quantity(value))
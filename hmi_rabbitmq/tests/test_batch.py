@@ -0,0 +1,37 @@
+import unittest
+
+from hmi_rabbitmq import generate_batch, RabbitMQBatchItem, RabbitMQChartRequest
+
+
+class TestBatch(unittest.TestCase):
+    def test_batch(self):
+        results = generate_batch([
+            ('ns1', 'rabbit1', None),
+            RabbitMQBatchItem(namespace='ns2', releasename='rabbit2', values={'rbac': {'create': False}}),
+        ], values={'metrics': {'enabled': True, 'serviceMonitor': {'enabled': True}}})
+        self.assertEqual([r.releasename for r in results], ['rabbit1', 'rabbit2'])
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual(len(results[0].chart.data), 9)
+        self.assertEqual(len(results[1].chart.data), 7)
+
+        # releases derived from the common values are the same as standalone requests
+        self.assertEqual(results[1].chart.data, RabbitMQChartRequest(namespace='ns2', releasename='rabbit2', values={
+            'metrics': {'enabled': True, 'serviceMonitor': {'enabled': True}}, 'rbac': {'create': False},
+        }).generate().data)
+        result = generate_batch([(None, 'rabbit3', None)])[0]
+        self.assertNotIn('namespace', result.chart.data[0]['metadata'])
+
+    def test_batch_error(self):
+        results = generate_batch([
+            ('ns1', 'rabbit1', {'configuration': 10}),
+            ('ns2', 'rabbit2', None),
+        ], executor='serial')
+        self.assertFalse(results[0].ok)
+        self.assertIsNone(results[0].chart)
+        self.assertTrue(results[1].ok)
+
+    def test_batch_process(self):
+        results = generate_batch([('ns{}'.format(i), 'rabbit', None) for i in range(3)],
+                                 executor='process', max_workers=2)
+        self.assertEqual([r.namespace for r in results], ['ns0', 'ns1', 'ns2'])
+        self.assertTrue(all(r.ok for r in results))
@@ -1,5 +1,8 @@
 import unittest
 
+import yaml
+from kubragen2.exception import InvalidParamError
+
 from hmi_rabbitmq import RabbitMQChartRequest
 
 
@@ -8,3 +11,339 @@ class TestChart(unittest.TestCase):
         req = RabbitMQChartRequest()
         chart = req.generate()
         self.assertEqual(len(chart.data), 8)
+
+    def test_options(self):
+        req = RabbitMQChartRequest(values={'service': {'metricsPort': 9999}})
+        self.assertEqual(req.options().option_get('metrics.podAnnotations.prometheus.io/port'), '9999')
+        self.assertEqual(req.options().option_get_opt('resources.limits.memory', '100Mi'), '100Mi')
+        self.assertFalse(req.options().has_option('persistence.unknown'))
+
+    def test_shared_skeleton(self):
+        chart1 = RabbitMQChartRequest(namespace='ns1').generate()
+        chart2 = RabbitMQChartRequest(namespace='ns2').generate()
+        role1 = next(d for d in chart1.data if d['kind'] == 'Role')
+        role2 = next(d for d in chart2.data if d['kind'] == 'Role')
+        self.assertIs(role1['rules'], role2['rules'])
+        self.assertNotIn('&id', yaml.dump_all(chart1.data + chart2.data, Dumper=yaml.SafeDumper))
+
+        # no value may be shared inside a chart, it would be written as a YAML anchor and alias
+        qos = {'resources': {'limits': {'cpu': '2', 'memory': '4Gi'}}, 'placement': {'guaranteedQoS': True}}
+        for mode in ('exec', 'diagnostics', 'tcp', 'http'):
+            for values in ({}, qos):
+                chart = RabbitMQChartRequest(namespace='ns1', values={
+                    **values,
+                    'replicas': 3,
+                    'clustering': {'enabled': True},
+                    'metrics': {'enabled': True},
+                    'upgrade': {'enabled': True},
+                    'stream': {'enabled': True},
+                    'startupProbe': {'enabled': True},
+                    'livenessProbe': {'mode': mode},
+                    'readinessProbe': {'mode': mode},
+                }).generate()
+                self.assertNotIn('&id', yaml.dump_all(chart.data, Dumper=yaml.SafeDumper), (mode, values))
+
+    def test_derive(self):
+        base = RabbitMQChartRequest(values={'metrics': {'enabled': True}})
+        values = {'service': {'metricsPort': 9999}, 'resources': {'limits': {'memory': '1Gi'}}}
+        derived = base.derive(values, namespace='ns1')
+        expected = RabbitMQChartRequest(namespace='ns1', values={
+            'metrics': {'enabled': True}, 'service': {'metricsPort': 9999}, 'resources': {'limits': {'memory': '1Gi'}},
+        })
+        self.assertEqual(derived.generate().data, expected.generate().data)
+        self.assertEqual(derived.fingerprint(), expected.fingerprint())
+        self.assertEqual(derived.options().option_get('metrics.podAnnotations.prometheus.io/port'), '9999')
+        self.assertEqual(base.namespace, 'default')
+        self.assertEqual(base.options().option_get('service.metricsPort'), 15692)
+        self.assertEqual(base.generate().data, RabbitMQChartRequest(values={'metrics': {'enabled': True}}).generate().data)
+
+    def test_clustered(self):
+        chart = RabbitMQChartRequest(namespace='mq', values={'replicas': 3, 'clustering': {'enabled': True}}).generate()
+        self.assertEqual(len(chart.data), 9)
+        statefulset = next(d for d in chart.data if d['kind'] == 'StatefulSet')
+        self.assertEqual(statefulset['spec']['replicas'], 3)
+        self.assertEqual(statefulset['spec']['podManagementPolicy'], 'Parallel')
+        self.assertIn('podAntiAffinity', statefulset['spec']['template']['spec']['affinity'])
+        self.assertEqual(len(statefulset['spec']['template']['spec']['topologySpreadConstraints']), 2)
+        pdb = next(d for d in chart.data if d['kind'] == 'PodDisruptionBudget')
+        self.assertEqual(pdb['spec']['maxUnavailable'], 1)
+        config = next(d for d in chart.data if d['kind'] == 'ConfigMap')['data']['rabbitmq.conf']
+        self.assertIn('cluster_formation.k8s.address_type = hostname', config)
+        self.assertIn('cluster_formation.k8s.hostname_suffix = .rabbitmq-headless.mq.svc.cluster.local', config)
+
+        # scaling doesn't change the immutable fields or the node names
+        single = next(d for d in RabbitMQChartRequest(namespace='mq', values={'clustering': {'enabled': True}})
+                      .generate().data if d['kind'] == 'StatefulSet')
+        self.assertEqual(single['spec']['podManagementPolicy'], 'Parallel')
+        self.assertEqual(single['spec']['template'], statefulset['spec']['template'])
+
+        with self.assertRaises(InvalidParamError):
+            RabbitMQChartRequest(namespace='mq', values={'replicas': 3}).generate()
+        with self.assertRaises(InvalidParamError):
+            RabbitMQChartRequest(namespace=None, values={'clustering': {'enabled': True}}).generate()
+
+    def test_single_replica(self):
+        statefulset = next(d for d in RabbitMQChartRequest().generate().data if d['kind'] == 'StatefulSet')
+        self.assertNotIn('podManagementPolicy', statefulset['spec'])
+        self.assertNotIn('affinity', statefulset['spec']['template']['spec'])
+        with self.assertRaises(InvalidParamError):
+            RabbitMQChartRequest(values={'replicas': 0}).generate()
+
+    def test_erlang_args(self):
+        def env(values):
+            statefulset = next(d for d in RabbitMQChartRequest(values=values).generate().data
+                               if d['kind'] == 'StatefulSet')
+            return {e['name']: e.get('value') for e in statefulset['spec']['template']['spec']['containers'][0]['env']}
+
+        self.assertNotIn('RABBITMQ_SERVER_ADDITIONAL_ERL_ARGS', env({}))
+        self.assertEqual(env({'resources': {'limits': {'cpu': '1500m'}}})['RABBITMQ_SERVER_ADDITIONAL_ERL_ARGS'],
+                         '+S 2:2 +sbwt none +sbwtdcpu none +sbwtdio none +A 32')
+        self.assertEqual(env({
+            'resources': {'limits': {'cpu': '4'}},
+            'erlang': {'schedulers': 2, 'schedulerBusyWait': 'short', 'asyncThreads': 8, 'distributionBufferSize': 64000},
+        })['RABBITMQ_SERVER_ADDITIONAL_ERL_ARGS'], '+S 2:2 +sbwt short +sbwtdcpu short +sbwtdio short +A 8 +zdbbl 64000')
+
+    def test_advanced_config(self):
+        data = RabbitMQChartRequest(values={'advancedConfiguration': '[{rabbit, []}].'}).generate().data
+        configmap = next(d for d in data if d['kind'] == 'ConfigMap')
+        self.assertEqual(configmap['data']['advanced.config'], '[{rabbit, []}].')
+        statefulset = next(d for d in data if d['kind'] == 'StatefulSet')
+        self.assertIn('/etc/rabbitmq/advanced.config', statefulset['spec']['template']['spec']['initContainers'][0]['command'][2])
+
+    def test_probes(self):
+        def container(values):
+            statefulset = next(d for d in RabbitMQChartRequest(values=values).generate().data
+                               if d['kind'] == 'StatefulSet')
+            return statefulset['spec']['template']['spec']['containers'][0]
+
+        default = container({})
+        self.assertEqual(default['livenessProbe']['exec']['command'], ['rabbitmq-diagnostics', 'status'])
+        self.assertEqual(default['livenessProbe']['periodSeconds'], 30)
+        self.assertEqual(default['livenessProbe']['timeoutSeconds'], 20)
+        self.assertNotIn('startupProbe', default)
+        self.assertEqual(default['livenessProbe']['initialDelaySeconds'], 120)
+        self.assertEqual(container({'startupProbe': {'enabled': True}})['livenessProbe']['initialDelaySeconds'], 0)
+        self.assertEqual(container({'startupProbe': {'enabled': True}, 'livenessProbe': {'initialDelaySeconds': 30}})[
+                             'livenessProbe']['initialDelaySeconds'], 30)
+
+        probes = container({
+            'startupProbe': {'enabled': True},
+            'livenessProbe': {'mode': 'tcp'},
+            'readinessProbe': {'mode': 'http', 'httpPath': '/metrics', 'httpPort': 'metrics'},
+        })
+        self.assertEqual(probes['startupProbe']['exec']['command'],
+                         ['rabbitmq-diagnostics', '-q', 'check_port_connectivity'])
+        self.assertEqual(probes['livenessProbe']['tcpSocket'], {'port': 'amqp'})
+        self.assertEqual(probes['readinessProbe']['httpGet'], {'path': '/metrics', 'port': 'metrics'})
+
+        with self.assertRaises(InvalidParamError):
+            container({'livenessProbe': {'mode': 'unknown'}})
+
+    def test_metrics_detailed(self):
+        data = RabbitMQChartRequest(values={
+            'metrics': {
+                'enabled': True,
+                'returnPerObjectMetrics': True,
+                'disableMetricsCollector': True,
+                'serviceMonitor': {
+                    'enabled': True,
+                    'detailed': {
+                        'queues': {
+                            'families': ['queue_coarse_metrics'],
+                            'interval': '120s',
+                            'metricRelabelings': [{'action': 'labeldrop', 'regex': 'channel'}],
+                        },
+                        'disabled': {'enabled': False},
+                    },
+                },
+            },
+        }).generate().data
+        config = next(d for d in data if d['kind'] == 'ConfigMap')['data']['rabbitmq.conf']
+        self.assertIn('prometheus.return_per_object_metrics = true', config)
+        self.assertIn('management_agent.disable_metrics_collector = true', config)
+        endpoints = next(d for d in data if d['kind'] == 'ServiceMonitor')['spec']['endpoints']
+        self.assertEqual(len(endpoints), 2)
+        self.assertNotIn('metricRelabelings', endpoints[0])
+        self.assertEqual(endpoints[1], {
+            'port': 'metrics',
+            'path': '/metrics/detailed',
+            'params': {'family': ['queue_coarse_metrics']},
+            'interval': '120s',
+            'metricRelabelings': [{'action': 'labeldrop', 'regex': 'channel'}],
+        })
+
+    def test_stream(self):
+        data = RabbitMQChartRequest(namespace='mq', values={'stream': {'enabled': True}}).generate().data
+        configmap = next(d for d in data if d['kind'] == 'ConfigMap')
+        self.assertIn('rabbitmq_stream', configmap['data']['enabled_plugins'])
+        self.assertIn('stream.listeners.tcp.1 = 5552', configmap['data']['rabbitmq.conf'])
+        self.assertIn('stream.advertised_port = 5552', configmap['data']['rabbitmq.conf'])
+        self.assertNotIn('stream.advertised_host', configmap['data']['rabbitmq.conf'])
+        for service in (d for d in data if d['kind'] == 'Service'):
+            self.assertIn(5552, [p['port'] for p in service['spec']['ports']])
+        pod = next(d for d in data if d['kind'] == 'StatefulSet')['spec']['template']['spec']
+        self.assertIn({'name': 'stream', 'containerPort': 5552, 'protocol': 'TCP'}, pod['containers'][0]['ports'])
+        self.assertEqual(pod['initContainers'][0]['env'], [{
+            'name': 'STREAM_ADVERTISED_HOST_SUFFIX', 'value': '.rabbitmq-headless.mq.svc.cluster.local'}])
+        self.assertIn('stream.advertised_host = $(hostname)', pod['initContainers'][0]['command'][2])
+
+        data = RabbitMQChartRequest(values={
+            'stream': {'enabled': True, 'advertisedHost': 'stream.example.com', 'advertisedPort': 443},
+        }).generate().data
+        config = next(d for d in data if d['kind'] == 'ConfigMap')['data']['rabbitmq.conf']
+        self.assertIn('stream.advertised_host = stream.example.com', config)
+        self.assertIn('stream.advertised_port = 443', config)
+        pod = next(d for d in data if d['kind'] == 'StatefulSet')['spec']['template']['spec']
+        self.assertNotIn('env', pod['initContainers'][0])
+
+        with self.assertRaises(InvalidParamError):
+            RabbitMQChartRequest(namespace=None, values={'stream': {'enabled': True}}).generate()
+        RabbitMQChartRequest(namespace=None, values={
+            'stream': {'enabled': True, 'advertisedHost': 'stream.example.com'}}).generate()
+
+    def test_extra_claims(self):
+        values = {
+            'persistence': {
+                'extraClaims': {
+                    'wal': {'size': '20Gi', 'storageClass': 'fast-ssd', 'mountPath': '/var/lib/rabbitmq/wal'},
+                },
+                'walClaim': 'wal',
+            },
+        }
+        data = RabbitMQChartRequest(values=values).generate().data
+        config = next(d for d in data if d['kind'] == 'ConfigMap')['data']['rabbitmq.conf']
+        self.assertIn('raft.wal_data_dir = /var/lib/rabbitmq/wal', config)
+        statefulset = next(d for d in data if d['kind'] == 'StatefulSet')
+        pod = statefulset['spec']['template']['spec']
+        self.assertEqual(pod['securityContext']['fsGroupChangePolicy'], 'OnRootMismatch')
+        self.assertIn({'name': 'rabbitmq-wal', 'mountPath': '/var/lib/rabbitmq/wal'}, pod['containers'][0]['volumeMounts'])
+        claim = statefulset['spec']['volumeClaimTemplates'][1]
+        self.assertEqual(claim['metadata']['name'], 'rabbitmq-wal')
+        self.assertEqual(claim['spec']['storageClassName'], 'fast-ssd')
+        self.assertEqual(claim['spec']['resources']['requests']['storage'], '20Gi')
+        self.assertEqual(claim['spec']['accessModes'], ['ReadWriteOnce'])
+
+        values['persistence']['enabled'] = False
+        pod = next(d for d in RabbitMQChartRequest(values=values).generate().data
+                   if d['kind'] == 'StatefulSet')['spec']['template']['spec']
+        self.assertIn({'name': 'rabbitmq-wal', 'emptyDir': {}}, pod['volumes'])
+
+        with self.assertRaises(InvalidParamError):
+            RabbitMQChartRequest(values={'persistence': {'walClaim': 'unknown'}}).generate()
+
+    def test_projected_config(self):
+        data = RabbitMQChartRequest(values={'configMode': 'projected'}).generate().data
+        pod = next(d for d in data if d['kind'] == 'StatefulSet')['spec']['template']['spec']
+        self.assertNotIn('initContainers', pod)
+        volumes = {v['name']: v for v in pod['volumes']}
+        self.assertNotIn('rabbitmq-config-erlang-cookie', volumes)
+        self.assertEqual(volumes['rabbitmq-config']['projected']['defaultMode'], 0o444)
+        container = pod['containers'][0]
+        env = {e['name']: e for e in container['env']}
+        self.assertEqual(env['RABBITMQ_CONFIG_FILE']['value'], '/etc/rabbitmq-config/rabbitmq.conf')
+        self.assertEqual(env['RABBITMQ_ERLANG_COOKIE']['valueFrom']['secretKeyRef'], {
+            'name': 'rabbitmq-config-secret', 'key': 'rabbitmq-erlang-cookie'})
+        self.assertIn({'name': 'rabbitmq-config', 'mountPath': '/etc/rabbitmq-config', 'readOnly': True},
+                      container['volumeMounts'])
+
+        with self.assertRaises(InvalidParamError):
+            RabbitMQChartRequest(values={'configMode': 'projected', 'stream': {'enabled': True}}).generate()
+
+    def test_guaranteed_placement(self):
+        values = {
+            'resources': {'limits': {'cpu': '2', 'memory': '4Gi'}},
+            'placement': {
+                'guaranteedQoS': True,
+                'priorityClassName': 'broker',
+                'nodeSelector': {'node-role/broker': 'true'},
+                'tolerations': [{'key': 'broker', 'operator': 'Exists', 'effect': 'NoSchedule'}],
+            },
+        }
+        pod = next(d for d in RabbitMQChartRequest(values=values).generate().data
+                   if d['kind'] == 'StatefulSet')['spec']['template']['spec']
+        expected = {'limits': {'cpu': '2', 'memory': '4Gi'}, 'requests': {'cpu': '2', 'memory': '4Gi'}}
+        self.assertEqual(pod['containers'][0]['resources'], expected)
+        self.assertEqual(pod['initContainers'][0]['resources'], expected)
+        self.assertIsNot(pod['initContainers'][0]['resources'], pod['containers'][0]['resources'])
+        self.assertEqual(pod['priorityClassName'], 'broker')
+        self.assertEqual(pod['nodeSelector'], {'node-role/broker': 'true'})
+        self.assertEqual(len(pod['tolerations']), 1)
+
+        for resources in ({'limits': {'cpu': '1500m', 'memory': '4Gi'}}, {'limits': {'cpu': '2'}}, None):
+            with self.assertRaises(InvalidParamError):
+                RabbitMQChartRequest(values={'resources': resources, 'placement': {'guaranteedQoS': True}}).generate()
+
+    def test_definitions(self):
+        data = RabbitMQChartRequest(values={'loadDefinition': {'enabled': True, 'value': '{}'}}).generate().data
+        secret = next(d for d in data if d['kind'] == 'Secret')
+        self.assertNotIn('data', secret)
+        self.assertEqual(secret['stringData']['load_definition.json'], '{}')
+        config = next(d for d in data if d['kind'] == 'ConfigMap')['data']['rabbitmq.conf']
+        self.assertIn('load_definitions = /etc/rabbitmq-load-definition/load_definition.json', config)
+
+        config = next(d for d in RabbitMQChartRequest().generate().data
+                      if d['kind'] == 'ConfigMap')['data']['rabbitmq.conf']
+        self.assertNotIn('load_definitions', config)
+
+        data = RabbitMQChartRequest(values={'loadDefinition': {
+            'enabled': True,
+            'source': 'configMap',
+            'shards': {'queues': '{"queues": []}', 'bindings': '{"bindings": []}'},
+            'skipIfUnchanged': True,
+        }}).generate().data
+        configmaps = {d['metadata']['name']: d['data'] for d in data if d['kind'] == 'ConfigMap'}
+        self.assertEqual(configmaps['rabbitmq-load-definition-queues'], {'queues.json': '{"queues": []}'})
+        self.assertEqual(configmaps['rabbitmq-load-definition-bindings'], {'bindings.json': '{"bindings": []}'})
+        config = configmaps['rabbitmq-config']['rabbitmq.conf']
+        self.assertIn('definitions.local.path = /etc/rabbitmq-load-definition/', config)
+        self.assertIn('definitions.skip_if_unchanged = true', config)
+        self.assertIn('definitions.hashing.algorithm = sha256', config)
+        self.assertNotIn('load_definitions', config)
+        pod = next(d for d in data if d['kind'] == 'StatefulSet')['spec']['template']['spec']
+        volume = next(v for v in pod['volumes'] if v['name'] == 'rabbitmq-config-load-definition')
+        self.assertEqual(len(volume['projected']['sources']), 2)
+
+    def test_checksum_annotations(self):
+        def annotations(namespace, values):
+            return next(d for d in RabbitMQChartRequest(namespace=namespace, values=values).generate().data
+                        if d['kind'] == 'StatefulSet')['spec']['template']['metadata']['annotations']
+
+        default = annotations('ns1', {})
+        self.assertEqual(default['prometheus.io/scrape'], 'true')
+        self.assertEqual(default, annotations('ns2', {}))
+        changed = annotations('ns1', {'extraConfiguration': 'handshake_timeout = 20000'})
+        self.assertNotEqual(default['checksum/config'], changed['checksum/config'])
+        self.assertEqual(default['checksum/secret'], changed['checksum/secret'])
+        self.assertNotEqual(default['checksum/secret'], annotations('ns1', {'auth': {'erlangCookie': 'x'}})['checksum/secret'])
+        self.assertNotIn('checksum/config', annotations('ns1', {'checksumAnnotations': False}))
+
+    def test_upgrade(self):
+        statefulset = next(d for d in RabbitMQChartRequest(values={
+            'replicas': 3,
+            'clustering': {'enabled': True},
+            'upgrade': {'enabled': True, 'partition': 2, 'terminationGracePeriodSeconds': 3600},
+        }).generate().data if d['kind'] == 'StatefulSet')
+        self.assertEqual(statefulset['spec']['updateStrategy'], {
+            'type': 'RollingUpdate', 'rollingUpdate': {'partition': 2}})
+        pod = statefulset['spec']['template']['spec']
+        self.assertEqual(pod['terminationGracePeriodSeconds'], 3600)
+        self.assertEqual(pod['containers'][0]['lifecycle']['preStop']['exec']['command'], [
+            '/bin/sh', '-c',
+            'rabbitmq-upgrade await_online_quorum_plus_one -t 3600 && '
+            'rabbitmq-upgrade await_online_synchronized_mirror -t 3600; rabbitmq-upgrade drain -t 3600'])
+
+        statefulset = next(d for d in RabbitMQChartRequest(values={'upgrade': {'enabled': True}}).generate().data
+                           if d['kind'] == 'StatefulSet')
+        self.assertEqual(statefulset['spec']['template']['spec']['containers'][0]['lifecycle']['preStop']['exec'][
+            'command'], ['/bin/sh', '-c', 'rabbitmq-upgrade drain -t 604800'])
+
+        # scaling a clustered release keeps the preStop hook
+        statefulset = next(d for d in RabbitMQChartRequest(values={
+            'clustering': {'enabled': True},
+            'upgrade': {'enabled': True, 'partition': 2, 'terminationGracePeriodSeconds': 3600},
+        }).generate().data if d['kind'] == 'StatefulSet')
+        self.assertEqual(statefulset['spec']['template']['spec'], pod)
+
+        statefulset = next(d for d in RabbitMQChartRequest().generate().data if d['kind'] == 'StatefulSet')
+        self.assertNotIn('updateStrategy', statefulset['spec'])
+        self.assertNotIn('lifecycle', statefulset['spec']['template']['spec']['containers'][0])
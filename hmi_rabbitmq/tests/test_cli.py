@@ -0,0 +1,46 @@
+import os
+import tempfile
+import unittest
+
+import yaml
+
+from hmi_rabbitmq.cli import main
+
+
+class TestCli(unittest.TestCase):
+    def test_render(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with open(os.path.join(tmpdir, 'rabbit1.yaml'), 'w') as fl:
+                fl.write('namespace: tenant1\nconfiguration:\n  log.console.level: warning\n')
+            with open(os.path.join(tmpdir, 'rabbit2.yaml'), 'w') as fl:
+                fl.write('rbac:\n  create: false\n')
+            outdir = os.path.join(tmpdir, 'out')
+            self.assertEqual(main(['render', os.path.join(tmpdir, '*.yaml'), '-o', outdir, '--executor', 'serial']), 0)
+            self.assertEqual(sorted(os.listdir(outdir)), ['default-rabbit2.yaml', 'tenant1-rabbit1.yaml'])
+            with open(os.path.join(outdir, 'tenant1-rabbit1.yaml')) as fl:
+                data = list(yaml.safe_load_all(fl))
+            configmap = next(d for d in data if d['kind'] == 'ConfigMap')
+            self.assertIn('log.console.level = warning', configmap['data']['rabbitmq.conf'])
+
+    def test_render_json(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with open(os.path.join(tmpdir, 'rabbit1.yaml'), 'w') as fl:
+                fl.write('namespace: tenant1\n')
+            outdir = os.path.join(tmpdir, 'out')
+            self.assertEqual(main(['render', os.path.join(tmpdir, 'rabbit1.yaml'), '-o', outdir,
+                                   '--format', 'ndjson']), 0)
+            with open(os.path.join(outdir, 'tenant1-rabbit1.ndjson')) as fl:
+                self.assertEqual(len(fl.readlines()), 8)
+
+    def test_render_duplicates(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for subdir in ('a', 'b'):
+                os.makedirs(os.path.join(tmpdir, subdir))
+                with open(os.path.join(tmpdir, subdir, 'rabbit.yaml'), 'w') as fl:
+                    fl.write('auth:\n  username: {}\n'.format(subdir))
+            with open(os.path.join(tmpdir, 'a', 'other.yaml'), 'w') as fl:
+                fl.write('namespace: tenant1\n')
+            outdir = os.path.join(tmpdir, 'out')
+            self.assertEqual(main(['render', os.path.join(tmpdir, '*', '*.yaml'), '-o', outdir,
+                                   '--executor', 'serial']), 1)
+            self.assertEqual(os.listdir(outdir), ['tenant1-other.yaml'])
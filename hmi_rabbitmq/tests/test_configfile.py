@@ -0,0 +1,132 @@
+import unittest
+
+from kubragen2.exception import InvalidParamError
+
+from hmi_rabbitmq import RabbitMQChartRequest, RabbitMQConfigFile
+from hmi_rabbitmq.configfile import parse_extra_configuration
+
+
+class TestConfigFile(unittest.TestCase):
+    def _rabbitmq_conf(self, req: RabbitMQChartRequest) -> str:
+        return next(d for d in req.generate().data if d['kind'] == 'ConfigMap')['data']['rabbitmq.conf']
+
+    def test_extra_configuration(self):
+        self.assertEqual(parse_extra_configuration('a = 1\n\n# comment\nb=x=y\n  c =  3  \n'), {
+            'a': '1',
+            'b': 'x=y',
+            'c': '3',
+        })
+        with self.assertRaises(InvalidParamError):
+            parse_extra_configuration('a')
+
+    def test_cache(self):
+        RabbitMQConfigFile.render_cache.clear()
+        conf1 = self._rabbitmq_conf(RabbitMQChartRequest(namespace='ns1', values={
+            'configuration': RabbitMQConfigFile(merge_config={'log.console.level': 'warning'}),
+        }))
+        conf2 = self._rabbitmq_conf(RabbitMQChartRequest(namespace='ns2', values={
+            'configuration': RabbitMQConfigFile(merge_config={'log.console.level': 'warning'}),
+        }))
+        self.assertIs(conf1, conf2)
+        self.assertEqual(RabbitMQConfigFile.render_cache.hits, 1)
+
+        conf3 = self._rabbitmq_conf(RabbitMQChartRequest(namespace='ns3', values={
+            'configuration': RabbitMQConfigFile(merge_config={'log.console.level': 'warning'}),
+            'auth': {'username': 'other'},
+        }))
+        self.assertIn('default_user = other', conf3)
+        self.assertEqual(RabbitMQConfigFile.render_cache.misses, 2)
+
+    def test_cache_subclass(self):
+        class ImageConfigFile(RabbitMQConfigFile):
+            def init_value(self, options):
+                ret = super().init_value(options)
+                ret.data['x.image'] = options.option_get('image.tag')
+                return ret
+
+        class ImageConfigFileCached(ImageConfigFile):
+            fingerprint_options = (*RabbitMQConfigFile.fingerprint_options, 'image.tag')
+
+        for cls in (ImageConfigFile, ImageConfigFileCached):
+            RabbitMQConfigFile.render_cache.clear()
+            for tag in ('3.8.9', '3.9.0'):
+                conf = self._rabbitmq_conf(RabbitMQChartRequest(values={
+                    'configuration': cls(), 'image': {'tag': tag}}))
+                self.assertIn('x.image = {}'.format(tag), conf)
+            self.assertEqual(RabbitMQConfigFile.render_cache.misses, 0 if cls is ImageConfigFile else 2)
+
+    def test_performance_profile(self):
+        conf = self._rabbitmq_conf(RabbitMQChartRequest(values={
+            'performanceProfile': 'low-memory',
+            'configuration': RabbitMQConfigFile(merge_config={'channel_max': 64}),
+        }))
+        self.assertIn('collect_statistics_interval = 60000', conf)
+        self.assertIn('channel_max = 64', conf)
+        self.assertNotIn('channel_max = 128', conf)
+        with self.assertRaises(InvalidParamError):
+            RabbitMQChartRequest(values={'performanceProfile': 'unknown'}).generate()
+
+    def test_memory_and_disk_limits(self):
+        conf = self._rabbitmq_conf(RabbitMQChartRequest(values={
+            'resources': {'limits': {'memory': '2Gi'}},
+            'memoryHighWatermark': {'enabled': True, 'pagingRatio': 0.75},
+            'diskFreeLimit': {'enabled': True},
+            'persistence': {'size': '50Gi'},
+        }))
+        self.assertIn('total_memory_available_override_value = 2147483648', conf)
+        self.assertIn('vm_memory_high_watermark.relative = 0.4', conf)
+        self.assertIn('vm_memory_high_watermark_paging_ratio = 0.75', conf)
+        self.assertIn('disk_free_limit.absolute = 5368709120', conf)
+
+        conf = self._rabbitmq_conf(RabbitMQChartRequest(values={
+            'resources': {'limits': {'memory': '4Gi'}},
+            'memoryHighWatermark': {'enabled': True, 'type': 'absolute', 'value': '3Gi'},
+            'diskFreeLimit': {'enabled': True},
+        }))
+        self.assertIn('vm_memory_high_watermark.absolute = 3221225472', conf)
+        self.assertIn('disk_free_limit.absolute = 4294967296', conf)
+
+        # the limit would be the whole 8Gi volume, or more
+        for memory in ('8Gi', '16Gi'):
+            with self.assertRaises(InvalidParamError):
+                RabbitMQChartRequest(values={
+                    'resources': {'limits': {'memory': memory}},
+                    'diskFreeLimit': {'enabled': True},
+                }).generate()
+        with self.assertRaises(InvalidParamError):
+            RabbitMQChartRequest(values={
+                'diskFreeLimit': {'enabled': True, 'ratio': 0.6},
+            }).generate()
+
+        with self.assertRaises(InvalidParamError):
+            RabbitMQChartRequest(values={
+                'diskFreeLimit': {'enabled': True},
+                'persistence': {'existingClaim': 'data'},
+            }).generate()
+
+    def test_network(self):
+        conf = self._rabbitmq_conf(RabbitMQChartRequest(values={
+            'performanceProfile': 'throughput',
+            'network': {'sndbuf': 65536, 'acceptors': {'tcp': 20}, 'heartbeat': 0},
+        }))
+        self.assertIn('tcp_listen_options.backlog = 4096', conf)
+        self.assertIn('tcp_listen_options.nodelay = true', conf)
+        self.assertIn('tcp_listen_options.sndbuf = 65536', conf)
+        self.assertIn('tcp_listen_options.recbuf = 196608', conf)
+        self.assertIn('num_acceptors.tcp = 20', conf)
+        self.assertIn('heartbeat = 0', conf)
+
+        data = RabbitMQChartRequest(values={
+            'network': {'backlog': 2048, 'sysctls': {'net.core.somaxconn': 4096, 'net.ipv4.tcp_keepalive_time': 60}},
+        }).generate().data
+        pod = next(d for d in data if d['kind'] == 'StatefulSet')['spec']['template']['spec']
+        self.assertEqual(pod['securityContext']['sysctls'], [
+            {'name': 'net.core.somaxconn', 'value': '4096'},
+            {'name': 'net.ipv4.tcp_keepalive_time', 'value': '60'},
+        ])
+
+        for network in ({'backlog': 0}, {'nodelay': 'yes'}, {'sndbuf': 10}, {'sysctls': {'vm.swappiness': 1}},
+                        {'backlog': 8192, 'sysctls': {'net.core.somaxconn': 4096}},
+                        {'backlog': 1024, 'sysctls': {'net.core.somaxconn': 'abc'}}):
+            with self.assertRaises(InvalidParamError):
+                RabbitMQChartRequest(values={'network': network}).generate()
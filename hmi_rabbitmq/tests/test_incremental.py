@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from kubragen2.exception import InvalidParamError
+
+from hmi_rabbitmq import RabbitMQChartRequest, RabbitMQConfigFile, HashManifest, generate_incremental
+
+
+class TestIncremental(unittest.TestCase):
+    def test_plugins_order(self):
+        req = RabbitMQChartRequest(values={'extraPlugins': 'rabbitmq_shovel', 'metrics': {'enabled': True}})
+        configmap = next(d for d in req.generate().data if d['kind'] == 'ConfigMap')
+        self.assertEqual(configmap['data']['enabled_plugins'],
+                         '[rabbitmq_management, rabbitmq_peer_discovery_k8s, rabbitmq_shovel, rabbitmq_prometheus].')
+
+    def test_fingerprint(self):
+        req1 = RabbitMQChartRequest(values={'configuration': RabbitMQConfigFile()})
+        req2 = RabbitMQChartRequest(values={'configuration': RabbitMQConfigFile()})
+        self.assertEqual(req1.fingerprint(), req2.fingerprint())
+        req1.generate()
+        self.assertEqual(req1.fingerprint(), req2.fingerprint())
+        self.assertEqual(req1.generate().resource_hashes(), req2.generate().resource_hashes())
+
+        # a new package version may generate different resources
+        current = req1.fingerprint()
+        with mock.patch('hmi_rabbitmq.chart.__version__', '0.0.0'):
+            self.assertNotEqual(req1.fingerprint(), current)
+
+        # functions have no stable hash
+        with self.assertRaises(InvalidParamError):
+            RabbitMQChartRequest(values={'extraEnvVars': [lambda: 1]}).fingerprint()
+
+    def test_incremental(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'manifest.json')
+
+            manifest = HashManifest.load(path)
+            result = generate_incremental(RabbitMQChartRequest(namespace='ns'), manifest)
+            self.assertEqual(len(result.added), 8)
+            manifest.save(path)
+
+            manifest = HashManifest.load(path)
+            result = generate_incremental(RabbitMQChartRequest(namespace='ns'), manifest)
+            self.assertTrue(result.skipped)
+
+            result = generate_incremental(RabbitMQChartRequest(namespace='ns', values={
+                'rbac': {'create': False},
+                'auth': {'username': 'other'},
+            }), manifest)
+            # the config checksum annotation changes the pod template
+            self.assertEqual([d['kind'] for d in result.changed], ['ConfigMap', 'StatefulSet'])
+            self.assertEqual([d['kind'] for d in result.removed], ['Role', 'RoleBinding'])
+
+            removed = manifest.prune([])
+            self.assertEqual(len(removed), 6)
+            self.assertEqual(manifest.releases, {})
@@ -0,0 +1,46 @@
+import tracemalloc
+import unittest
+
+from kubragen2.exception import InvalidParamError
+
+from hmi_rabbitmq import RabbitMQChartRequest, RabbitMQConfigFile, Instrumentation, generate_batch
+
+
+class TestInstrumentation(unittest.TestCase):
+    def test_request(self):
+        records = []
+        instrumentation = Instrumentation(callback=records.append)
+        req = RabbitMQChartRequest(namespace='ns', values={'configuration': RabbitMQConfigFile(use_cache=False)},
+                                   instrumentation=instrumentation)
+        req.generate()
+        summary = instrumentation.summary()
+        self.assertEqual(set(summary.keys()), {'options', 'resolve', 'resources', 'build', 'configfile',
+                                               'configfile.init_value', 'configfile.extensions',
+                                               'configfile.finish_value', 'configfile.render'})
+        self.assertEqual(summary['build'].count, 8)
+        self.assertEqual(len(records), len(instrumentation.records))
+        self.assertTrue(all(r.release == 'ns/rabbitmq' for r in records))
+
+    def test_trace_memory(self):
+        instrumentation = Instrumentation(trace_memory=True)
+        RabbitMQChartRequest(instrumentation=instrumentation).generate()
+        self.assertIsNotNone(instrumentation.summary()['options'].memory)
+        self.assertFalse(tracemalloc.is_tracing())
+
+        # tracing started by the caller is left running
+        tracemalloc.start()
+        try:
+            RabbitMQChartRequest(instrumentation=Instrumentation(trace_memory=True)).generate()
+            self.assertTrue(tracemalloc.is_tracing())
+        finally:
+            tracemalloc.stop()
+
+    def test_batch(self):
+        results = generate_batch([('ns1', 'rabbit', None), ('ns2', 'rabbit', None)], executor='serial',
+                                 instrument=True)
+        summary = Instrumentation.aggregate(r.instrumentation for r in results)
+        self.assertEqual(summary['options'].count, 2)
+        self.assertEqual(summary['build'].count, 16)
+
+        with self.assertRaises(InvalidParamError):
+            generate_batch([('ns1', 'rabbit', None)], executor='thread', trace_memory=True)
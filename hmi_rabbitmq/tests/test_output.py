@@ -0,0 +1,48 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import yaml
+from kubragen2.exception import InvalidParamError
+from kubragen2.output import OutputFile_Kubernetes, OutputDataDumper
+
+from hmi_rabbitmq import RabbitMQChartRequest, stream_resources, write_yaml, write_file
+
+
+class TestOutput(unittest.TestCase):
+    def test_generate_iter(self):
+        req = RabbitMQChartRequest()
+        self.assertEqual(list(req.generate_iter()), req.generate().data)
+
+    def test_write_yaml(self):
+        file = OutputFile_Kubernetes('rabbitmq.yaml')
+        file.append(RabbitMQChartRequest(namespace='ns1').generate().data +
+                    RabbitMQChartRequest(namespace='ns2').generate().data)
+
+        stream = io.StringIO()
+        count = write_yaml(stream_resources(RabbitMQChartRequest(namespace=ns) for ns in ['ns1', 'ns2']), stream)
+        self.assertEqual(count, 16)
+        self.assertEqual(stream.getvalue(), file.to_string(OutputDataDumper()))
+
+    def test_formats(self):
+        chart = RabbitMQChartRequest().generate()
+        for format in ('yaml', 'json', 'ndjson'):
+            stream = io.StringIO()
+            self.assertEqual(chart.write(stream, format), 8)
+            if format == 'yaml':
+                data = list(yaml.safe_load_all(stream.getvalue()))
+            elif format == 'json':
+                value = json.loads(stream.getvalue())
+                self.assertEqual(value['kind'], 'List')
+                data = value['items']
+            else:
+                data = [json.loads(line) for line in stream.getvalue().splitlines()]
+            self.assertEqual(data, chart.data)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'rabbitmq.json')
+            self.assertEqual(write_file(chart.data, filename, 'ndjson'), 8)
+            with self.assertRaises(InvalidParamError):
+                write_file(chart.data, filename, 'xml')
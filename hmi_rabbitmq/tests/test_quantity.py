@@ -0,0 +1,29 @@
+import unittest
+from decimal import Decimal
+
+from kubragen2.exception import InvalidParamError
+
+from hmi_rabbitmq.quantity import parse_quantity, cpu_cores, quantity_bytes
+
+
+class TestQuantity(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(parse_quantity('500m'), Decimal('0.5'))
+        self.assertEqual(parse_quantity('2'), 2)
+        self.assertEqual(parse_quantity(2), 2)
+        self.assertEqual(parse_quantity('1e3'), 1000)
+        self.assertEqual(parse_quantity('1E'), 10 ** 18)
+        for value in ('', 'abc', '1Xi', '1.2.3', True):
+            with self.assertRaises(InvalidParamError):
+                parse_quantity(value)
+
+    def test_cpu_cores(self):
+        self.assertEqual(cpu_cores('100m'), 1)
+        self.assertEqual(cpu_cores('1500m'), 2)
+        self.assertEqual(cpu_cores(4), 4)
+
+    def test_bytes(self):
+        self.assertEqual(quantity_bytes('512Mi'), 536870912)
+        self.assertEqual(quantity_bytes('1.5Gi'), 1610612736)
+        self.assertEqual(quantity_bytes('8G'), 8000000000)
+        self.assertEqual(quantity_bytes('100k'), 100000)
@@ -28,10 +28,15 @@ setuptools.setup(
     zip_safe=False,
     install_requires=INSTALL_REQUIRES,
     test_suite="hmi_rabbitmq.tests",
+    entry_points={
+        'console_scripts': [
+            'hmi-rabbitmq=hmi_rabbitmq.cli:main',
+        ],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
 )